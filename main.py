@@ -1,9 +1,8 @@
-import tarfile
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from sys import platform
 import fitz
-import time
-import gzip
 
 import docker
 
@@ -11,15 +10,19 @@ from pdfextract.export_annotation import export_annotation
 from pdfextract.pdf_extract import pdf_extract
 from texannotate.annotate_file import annotate_file
 from texannotate.color_annotation import ColorAnnotation
-from utils.utils import (find_free_port, find_latex_file,
+from utils.utils import (check_container_ready, find_free_port, find_latex_file,
                               postprocess_latex, preprocess_latex, tup2str)
-from texcompile.client import compile_pdf_return_bytes, CompilationException
+from utils.source_tree import SourceTree
+from utils.ledger import JobLedger
+from texcompile.client import Balancer, compile_pdf_return_bytes, get_default_balancer, CompilationException
 import shutil
 
 import logging
 logger = logging.getLogger(name=None)
 logger.setLevel(logging.ERROR)
 
+EXTRACT_WORKERS = os.cpu_count() or 1 # papers run one at a time, so each extraction uses all cores
+
 def main(input_path: Path, output_path: Path, debug = False):
     #check docker image
     client = docker.from_env()
@@ -28,100 +31,96 @@ def main(input_path: Path, output_path: Path, debug = False):
     except docker.errors.ImageNotFound:
         client.images.build(path='texcompile/service', tag='tex-compilation-service')
 
-    port = find_free_port()
     if platform == "linux" or platform == "linux2":
         from memory_tempfile import MemoryTempfile
         tempfile = MemoryTempfile()
-        container = client.containers.run(
-            image='tex-compilation-service',
-            detach=True,
-            ports={'80/tcp':port},
-            tmpfs={'/tmpfs':''},
-            remove=True,
-        )
     else:
         import tempfile
-        container = client.containers.run(
-            image='tex-compilation-service',
-            detach=True,
-            ports={'80/tcp':port},
-            #tmpfs={'/tmpfs':''},
-            remove=True,
-        )
-    time.sleep(5)
-    errors = {}
+    # Compiles are spread over the services listed in TEXCOMPILE_ENDPOINTS, if any;
+    # otherwise a single local container is started.
+    balancer = get_default_balancer()
+    container = None
+    if balancer is None:
+        port = find_free_port()
+        if platform == "linux" or platform == "linux2":
+            container = client.containers.run(
+                image='tex-compilation-service',
+                detach=True,
+                ports={'80/tcp':port},
+                tmpfs={'/tmpfs':''},
+                remove=True,
+            )
+        else:
+            container = client.containers.run(
+                image='tex-compilation-service',
+                detach=True,
+                ports={'80/tcp':port},
+                #tmpfs={'/tmpfs':''},
+                remove=True,
+            )
+        check_container_ready(container, port)
+        balancer = Balancer([("http://127.0.0.1", port)])
+    output_path.mkdir(exist_ok=True)
+    ledger = JobLedger(output_path/'ledger.db')
+    skip = ledger.to_skip(['annotate']) # finished or permanently failed papers
+    # started once and reused by the extractions of all papers
+    extract_pool = ProcessPoolExecutor(EXTRACT_WORKERS) if EXTRACT_WORKERS > 1 else None
     for filename in input_path.glob('*.gz'):
         print(filename)
-        if Path('outputs/'+str(filename.stem)+'_data.csv').exists():
+        if filename.stem in skip:
             continue
         try:
-            with tempfile.TemporaryDirectory() as td:
-                #print('temp dir', td)
-                try:
-                    with tarfile.open(filename ,'r:gz') as tar:
-                        tar.extractall(td)
-                except tarfile.ReadError:
-                    with gzip.open(filename, 'rb') as gz:
-                        bytes_ = gz.read()
-                        with open(td + '/main.tex', 'wb') as file:
-                            file.write(bytes_)
-                preprocess_latex(td)
+            with ledger.stage(filename.stem, 'annotate'):
+                tree = SourceTree.from_archive(filename) # decompress once, shared by all passes
+                with tempfile.TemporaryDirectory() as td:
+                    #print('temp dir', td)
+                    tree.write_to(td)
+                    preprocess_latex(td)
+
+                    basename, pdf_bytes = balancer.call(
+                        compile_pdf_return_bytes,
+                        sources_dir=td,
+                        aux_key=filename.stem+'-plain', # later passes are seeded with its .aux/.bbl files
+                    ) # compile the unmodified latex firstly
+                    shapes, tokens = pdf_extract(pdf_bytes, workers=EXTRACT_WORKERS, executor=extract_pool)
+                    ## get colors
+                    color_dict = ColorAnnotation()
+                    for rect in shapes:
+                        color_dict.add_existing_color(tup2str(rect['stroking_color']))
+                    for token in tokens:
+                        color_dict.add_existing_color(token['color'])
+
+                    tree.restore(td)
+                    tex_file = find_latex_file(Path(basename).stem, basepath=td)
+                    color_dict.extract_defs(tex_file, td, None, balancer)
+                    annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
+                    postprocess_latex(tex_file)
+                    shutil.make_archive(output_path/filename.stem, 'zip', td)
+                    basename, pdf_bytes = balancer.call(
+                        compile_pdf_return_bytes,
+                        sources_dir=td,
+                        aux_key=filename.stem+'-colored', seed_key=filename.stem+'-plain',
+                    ) # compile the modified latex
+                    shapes, tokens = pdf_extract(pdf_bytes, workers=EXTRACT_WORKERS, executor=extract_pool)
+                    color_dict.run_standardize_tex()
+                    df_toc, df_data = export_annotation(shapes, tokens, color_dict)
+                    df_toc.to_csv(output_path/(str(filename.stem)+'_toc.csv'), sep='\t')
+                    df_data.to_csv(output_path/(str(filename.stem)+'_data.csv'), sep='\t')
 
-                basename, pdf_bytes = compile_pdf_return_bytes(
-                    sources_dir=td,
-                    port=port
-                ) # compile the unmodified latex firstly
-                shapes, tokens = pdf_extract(pdf_bytes)
-                ## get colors
-                color_dict = ColorAnnotation()
-                for rect in shapes:
-                    color_dict.add_existing_color(tup2str(rect['stroking_color']))
-                for token in tokens:
-                    color_dict.add_existing_color(token['color'])
-            with tempfile.TemporaryDirectory() as td:
-                try:
-                    with tarfile.open(filename ,'r:gz') as tar:
-                        tar.extractall(td)
-                except tarfile.ReadError:
-                    with gzip.open(filename, 'rb') as gz:
-                        bytes_ = gz.read()
-                        with open(td + '/main.tex', 'wb') as file:
-                            file.write(bytes_)
-                tex_file = find_latex_file(Path(basename).stem, basepath=td)
-                color_dict.extract_defs(tex_file, td, port)
-                annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
-                postprocess_latex(tex_file)
-                shutil.make_archive(output_path/filename.stem, 'zip', td)
-                basename, pdf_bytes = compile_pdf_return_bytes(
-                    sources_dir=td,
-                    port=port
-                ) # compile the modified latex
-                shapes, tokens = pdf_extract(pdf_bytes)
-                color_dict.run_standardize_tex()
-            df_toc, df_data = export_annotation(shapes, tokens, color_dict)
-            df_toc.to_csv(output_path/(str(filename.stem)+'_toc.csv'), sep='\t')
-            df_data.to_csv(output_path/(str(filename.stem)+'_data.csv'), sep='\t')
-            with tempfile.TemporaryDirectory() as td:
-                color_dict = ColorAnnotation()
-                color_dict.black = True
-                try:
-                    with tarfile.open(filename ,'r:gz') as tar:
-                        tar.extractall(td)
-                except tarfile.ReadError:
-                    with gzip.open(filename, 'rb') as gz:
-                        bytes_ = gz.read()
-                        with open(td + '/main.tex', 'wb') as file:
-                            file.write(bytes_)
-                tex_file = find_latex_file(Path(basename).stem, basepath=td)
-                # color_dict.extract_defs(tex_file, td, port)
-                annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
-                postprocess_latex(tex_file)
-                basename, pdf_bytes = compile_pdf_return_bytes(
-                    sources_dir=td,
-                    port=port
-                ) # compile the modified latex
-                with fitz.open("pdf", pdf_bytes) as doc:
-                    doc.save(output_path/(str(filename.stem)+'.pdf'))
+                    tree.restore(td)
+                    color_dict = ColorAnnotation()
+                    color_dict.black = True
+                    tex_file = find_latex_file(Path(basename).stem, basepath=td)
+                    # color_dict.extract_defs(tex_file, td, port)
+                    annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
+                    postprocess_latex(tex_file)
+                    basename, pdf_bytes = balancer.call(
+                        compile_pdf_return_bytes,
+                        sources_dir=td,
+                        aux_key=filename.stem+'-black', seed_key=filename.stem+'-plain',
+                    ) # compile the modified latex
+                    with fitz.open("pdf", pdf_bytes) as doc:
+                        doc.save(output_path/(str(filename.stem)+'.pdf'))
 
         except CompilationException:
             #print('LaTeX code compilation error.')
@@ -129,9 +128,12 @@ def main(input_path: Path, output_path: Path, debug = False):
         except Exception as e:
             #print(e)
             print('error:', filename, str(e))
-    container.stop()
-    import json
-    json.dump(errors, open('errors_main.json', 'w'), indent=2)
+    if extract_pool is not None:
+        extract_pool.shutdown()
+    if container is not None:
+        container.stop()
+    for row in ledger.failures():
+        print('failed:', row['error_class'], row['count'])
 
 if __name__ == "__main__":
     main(Path("downloaded"), Path('outputs'), debug=False)
\ No newline at end of file
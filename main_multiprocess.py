@@ -1,8 +1,6 @@
 from pebble import ProcessPool
-from concurrent.futures import TimeoutError, as_completed
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
 from multiprocessing import set_start_method
-import gzip
-import tarfile
 from pathlib import Path
 from sys import platform
 from pdfextract.export_annotation import export_annotation
@@ -10,7 +8,8 @@ from pdfextract.pdf_extract import pdf_extract
 from texannotate.annotate_file import annotate_file
 from texannotate.color_annotation import ColorAnnotation
 from utils.utils import find_latex_file, postprocess_latex, preprocess_latex, tup2str
-from texcompile.client import compile_pdf_return_bytes, CompilationException
+from utils.source_tree import SourceTree
+from texcompile.client import compile_workspace_pdf, create_workspace, delete_workspace, CompilationException, ServerConnectionException
 import shutil
 import fitz
 from collections import OrderedDict
@@ -28,7 +27,8 @@ try:
 except docker.errors.ImageNotFound:
     print('Docker image not found, compiling... \n It takes ~10 min.')
     client.images.build(path='texcompile/service', tag='tex-compilation-service')
-from utils.utils import start_container
+from utils.container_pool import REAP_WAIT, ContainerPool
+from utils.ledger import JobLedger
 
 import logging
 logger = logging.getLogger(name=None)
@@ -36,87 +36,108 @@ logger.setLevel(logging.ERROR)
 logging.basicConfig(filename='error.log', encoding='utf-8', level=logging.ERROR)
 
 TIMEOUT_SECONDS = 60 * 60
+NUM_WORKERS = 96
+NUM_CONTAINERS = 96 # warm compile containers shared by all workers
 
-def annotate(filename: Path, output: Path):
-    try:
-        container, port = start_container(filename.stem)
-        print('Start:' ,filename, 'On port:', port) # os.getpid(),
-
-        with tempfile.TemporaryDirectory() as td:
-            try:
-                with tarfile.open(filename ,'r:gz') as tar:
-                    tar.extractall(td)
-            except tarfile.ReadError:
-                with gzip.open(filename, 'rb') as gz:
-                    bytes_ = gz.read()
-                    with open(td + '/main.tex', 'wb') as file:
-                        file.write(bytes_)
-
-            preprocess_latex(td)
-            basename, pdf_bytes = compile_pdf_return_bytes(
-                sources_dir=td,
-                port=port
-            ) # compile the unmodified latex firstly
-            shapes, tokens = pdf_extract(pdf_bytes)
-            ## get colors
-            color_dict = ColorAnnotation()
-            for rect in shapes:
-                color_dict.add_existing_color(tup2str(rect['stroking_color']))
-            for token in tokens:
-                color_dict.add_existing_color(token['color'])
-
-        with tempfile.TemporaryDirectory() as td:
-            try:
-                with tarfile.open(filename ,'r:gz') as tar:
-                    tar.extractall(td)
-            except tarfile.ReadError:
-                with gzip.open(filename, 'rb') as gz:
-                    bytes_ = gz.read()
-                    with open(td + '/main.tex', 'wb') as file:
-                        file.write(bytes_)
-            tex_file = find_latex_file(Path(basename).stem, basepath=td)
-            color_dict.extract_defs(tex_file, td, port)
-            annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
-            postprocess_latex(tex_file)
-            shutil.make_archive(output/filename.stem, 'zip', td) # save annotated files for debugging
-            basename, pdf_bytes = compile_pdf_return_bytes(
-                sources_dir=td,
-                port=port
-            ) # compile the modified latex
-            shapes, tokens = pdf_extract(pdf_bytes)
-            color_dict.run_standardize_tex()
+def annotate_colored(filename: Path, output: Path, tree: SourceTree, workspace: str, td: str, basename: str, color_dict: ColorAnnotation, port: int, ledger: JobLedger):
+    with ledger.stage(filename.stem, 'colored') as record:
+        tex_file = find_latex_file(Path(basename).stem, basepath=td)
+        color_dict.extract_defs(tex_file, td, port)
+        annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
+        postprocess_latex(tex_file)
+        shutil.make_archive(output/filename.stem, 'zip', td) # save annotated files for debugging
+        _, pdf_bytes = compile_workspace_pdf(
+            workspace, *tree.diff(td), # only the annotated files are uploaded
+            port=port,
+            sources_dir=td, # the materialized tree, for the compile cache
+            aux_key=filename.stem+'-colored',
+            seed_key=filename.stem+'-plain', # .aux/.bbl files of the plain pass
+        ) # compile the modified latex
+        shapes, tokens = pdf_extract(pdf_bytes) # overlaps the black compile
+        color_dict.run_standardize_tex()
         df_toc, df_data = export_annotation(shapes, tokens, color_dict)
         df_toc.to_csv(output/(str(filename.stem)+'_toc.csv'), sep='\t')
         df_data.to_csv(output/(str(filename.stem)+'_data.csv'), sep='\t')
-        with tempfile.TemporaryDirectory() as td:
-            color_dict = ColorAnnotation()
-            color_dict.black = True
-            try:
-                with tarfile.open(filename ,'r:gz') as tar:
-                    tar.extractall(td)
-            except tarfile.ReadError:
-                with gzip.open(filename, 'rb') as gz:
-                    bytes_ = gz.read()
-                    with open(td + '/main.tex', 'wb') as file:
-                        file.write(bytes_)
-            tex_file = find_latex_file(Path(basename).stem, basepath=td)
-            # color_dict.extract_defs(tex_file, td, port)
-            annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
-            postprocess_latex(tex_file)
-            basename, pdf_bytes = compile_pdf_return_bytes(
-                sources_dir=td,
-                port=port
-            ) # compile the modified latex
-            with fitz.open("pdf", pdf_bytes) as doc:
-                doc.save(output/(str(filename.stem)+'.pdf'))
+        record.output(output/(str(filename.stem)+'_data.csv'))
+
+
+def annotate_black(filename: Path, output: Path, tree: SourceTree, workspace: str, td: str, basename: str, port: int, ledger: JobLedger):
+    with ledger.stage(filename.stem, 'black') as record:
+        color_dict = ColorAnnotation()
+        color_dict.black = True
+        tex_file = find_latex_file(Path(basename).stem, basepath=td)
+        # color_dict.extract_defs(tex_file, td, port)
+        annotate_file(tex_file, color_dict, latex_context=None, basepath=td)
+        postprocess_latex(tex_file)
+        _, pdf_bytes = compile_workspace_pdf(
+            workspace, *tree.diff(td),
+            port=port,
+            sources_dir=td,
+            aux_key=filename.stem+'-black',
+            seed_key=filename.stem+'-plain',
+        ) # compile the modified latex
+        with fitz.open("pdf", pdf_bytes) as doc:
+            doc.save(output/(str(filename.stem)+'.pdf'))
+        record.output(pdf_bytes)
+
+
+def annotate(filename: Path, output: Path, containers: ContainerPool, ledger: JobLedger):
+    paper = filename.stem
+    done = ledger.done_stages(paper) # stages finished by a previous run are skipped
+    try:
+        with containers.lease() as port:
+            print('Start:' ,filename, 'On port:', port) # os.getpid(),
+
+            tree = SourceTree.from_archive(filename) # decompress once, shared by all passes
+            with tempfile.TemporaryDirectory() as td:
+                tree.write_to(td)
+                # the original tree is uploaded once, each pass then sends the files it changed
+                workspace = create_workspace(td, port=port)
+                try:
+                    if 'colored' not in done: # the colored pass needs the colors of the plain PDF
+                        with ledger.stage(paper, 'plain') as record:
+                            preprocess_latex(td)
+                            basename, pdf_bytes = compile_workspace_pdf(
+                                workspace, *tree.diff(td),
+                                port=port,
+                                sources_dir=td,
+                                aux_key=filename.stem+'-plain',
+                            ) # compile the unmodified latex firstly
+                            shapes, tokens = pdf_extract(pdf_bytes)
+                            record.output(pdf_bytes)
+                            record.detail = basename
+                        ## get colors
+                        color_dict = ColorAnnotation()
+                        for rect in shapes:
+                            color_dict.add_existing_color(tup2str(rect['stroking_color']))
+                        for token in tokens:
+                            color_dict.add_existing_color(token['color'])
+                        tree.restore(td)
+                    else:
+                        basename = ledger.get(paper, 'plain')['detail']
+
+                    # The colored and the black variant only depend on the plain compile, so both
+                    # are annotated and compiled concurrently, each in its own copy of the tree.
+                    with tempfile.TemporaryDirectory() as td_black:
+                        tree.write_to(td_black, link_from=td)
+                        with ThreadPoolExecutor(max_workers=2) as executor:
+                            futures = []
+                            if 'colored' not in done:
+                                futures.append(executor.submit(annotate_colored, filename, output, tree, workspace, td, basename, color_dict, port, ledger))
+                            if 'black' not in done:
+                                futures.append(executor.submit(annotate_black, filename, output, tree, workspace, td_black, basename, port, ledger))
+                            for future in futures:
+                                future.result()
+                finally:
+                    try:
+                        delete_workspace(workspace, port=port)
+                    except ServerConnectionException:
+                        pass # expired with the service's keep_seconds otherwise
 
-        container.stop()
         return filename, False
     except CompilationException:
-        container.stop()
         return filename, 'LaTeX code compilation error.'
     except Exception as e:
-        container.stop()
         return filename, str(e)
     
 
@@ -128,16 +149,19 @@ if __name__ == "__main__":
     input_path = p/'downloaded'
     output_path = p/'outputs'
     output_path.mkdir(exist_ok=True)
+    ledger = JobLedger(output_path/'ledger.db')
+    skip = ledger.to_skip(['colored', 'black']) # finished or permanently failed papers
     args = []
     for filename in input_path.glob('*.gz'):
-        if not Path(output_path/(str(filename.stem)+'.pdf')).exists():
+        if filename.stem not in skip:
             args.append((filename, output_path))
     print('Find %d source files, starting annotate.' %len(args))
-    with ProcessPool(max_workers=96) as pool:
+    containers = ContainerPool(NUM_CONTAINERS).start()
+    with ProcessPool(max_workers=NUM_WORKERS) as pool:
         try:
             tasks = OrderedDict()
             for arg in args:
-                future = pool.schedule(annotate, args=arg, timeout=TIMEOUT_SECONDS)
+                future = pool.schedule(annotate, args=arg+(containers, ledger), timeout=TIMEOUT_SECONDS)
                 tasks[future] = arg
             
             finished = 0
@@ -148,10 +172,15 @@ if __name__ == "__main__":
                     r = future.result()  # blocks until results are ready
                 except TimeoutError as error:
                     r = (tasks[future][0], 'Timeout.') 
+                    ledger.abort(tasks[future][0].stem, 'Timeout')
+                    containers.reap(REAP_WAIT) # the killed worker never returned its container
+                containers.reap() # workers that exited late after an earlier timeout
                 if r[1]:
                     logger.error(r[0].name + '\t' + r[1] + '\n')
                 print("Finished task:{0}/{1}".format(finished, num_tasks))
         except KeyboardInterrupt:
             pool.terminate()
             pool.join()
-            pool.close()
\ No newline at end of file
+            pool.close()
+        finally:
+            containers.stop()
\ No newline at end of file
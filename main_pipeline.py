@@ -0,0 +1,241 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import set_start_method
+from pathlib import Path
+from sys import platform
+import shutil
+import threading
+import fitz
+
+from pdfextract.export_annotation import export_annotation
+from pdfextract.pdf_extract import pdf_extract
+from texannotate.annotate_file import annotate_file
+from texannotate.color_annotation import ColorAnnotation
+from utils.utils import READY_TIMEOUT, find_latex_file, postprocess_latex, preprocess_latex, tup2str
+from utils.source_tree import SourceTree
+from utils.pipeline import Pipeline, Stage
+from utils.container_pool import ContainerPool
+from utils.ledger import JobLedger
+from texcompile.client import compile_pdf_return_bytes, CompilationException
+
+if platform == "linux" or platform == "linux2":
+    from memory_tempfile import MemoryTempfile
+    tempfile = MemoryTempfile()
+else:
+    import tempfile
+
+import logging
+logger = logging.getLogger(name=None)
+logger.setLevel(logging.ERROR)
+logging.basicConfig(filename='error.log', encoding='utf-8', level=logging.ERROR)
+
+
+class PaperJob:
+    """
+    State of one paper while it moves through the pipeline stages.
+    """
+
+    def __init__(self, filename: Path, output: Path):
+        self.filename = filename
+        self.output = output
+        self.tree = None
+        self.td = None
+        self.basename = None
+        self.pdf_bytes = None
+        self.shapes = None
+        self.tokens = None
+        self.color_dict = None
+        self.td_black = None
+        self.black = None
+
+    @property
+    def name(self) -> str:
+        return self.filename.stem
+
+    def cleanup(self):
+        if self.td is not None:
+            self.td.cleanup()
+            self.td = None
+        if self.td_black is not None:
+            self.td_black.cleanup()
+            self.td_black = None
+        self.tree = None
+        self.pdf_bytes = None
+
+
+class AnnotatePipeline:
+    """
+    Stage-pipelined version of `main_multiprocess.annotate`: while one paper is compiled by the
+    TeX service, the PDF of another one is extracted in the process pool and a third one is
+    being annotated.
+    """
+
+    def __init__(self, containers: ContainerPool, processes: ProcessPoolExecutor, ledger: JobLedger,
+                 load_workers=2, compile_workers=8, extract_workers=8,
+                 annotate_workers=4, export_workers=2):
+        self.containers = containers
+        self.processes = processes
+        self.ledger = ledger
+        self.pipeline = Pipeline([self.recorded(stage) for stage in [
+            Stage('load', self.load, load_workers),
+            Stage('compile', self.compile_plain, compile_workers),
+            Stage('extract', self.extract_plain, extract_workers),
+            Stage('annotate', self.annotate, annotate_workers),
+            Stage('compile_annotated', self.compile_annotated, compile_workers),
+            Stage('extract_annotated', self.extract_annotated, extract_workers),
+            Stage('export', self.export, export_workers),
+        ]], on_done=self.done, on_error=self.error)
+        self.black_compiles = ThreadPoolExecutor(max_workers=compile_workers)
+        self.finished = 0
+        self._lock = threading.Lock()
+
+    def recorded(self, stage: Stage) -> Stage:
+        fn = stage.fn
+        def run(job: PaperJob):
+            with self.ledger.stage(job.name, stage.name):
+                return fn(job)
+        stage.fn = run
+        return stage
+
+    def compile(self, td, aux_key, seed_key=None):
+        with self.containers.lease() as port:
+            return compile_pdf_return_bytes(sources_dir=td, port=port, aux_key=aux_key, seed_key=seed_key)
+
+    def load(self, job: PaperJob):
+        job.tree = SourceTree.from_archive(job.filename)
+        job.td = tempfile.TemporaryDirectory()
+        job.tree.write_to(job.td.name)
+        preprocess_latex(job.td.name)
+        return job
+
+    def compile_plain(self, job: PaperJob):
+        job.basename, job.pdf_bytes = self.compile(job.td.name, job.name+'-plain') # compile the unmodified latex firstly
+        return job
+
+    def extract_plain(self, job: PaperJob):
+        shapes, tokens = self.processes.submit(pdf_extract, job.pdf_bytes).result()
+        ## get colors
+        job.color_dict = ColorAnnotation()
+        for rect in shapes:
+            job.color_dict.add_existing_color(tup2str(rect['stroking_color']))
+        for token in tokens:
+            job.color_dict.add_existing_color(token['color'])
+        return job
+
+    def annotate(self, job: PaperJob):
+        td = job.td.name
+        job.tree.restore(td)
+        tex_file = find_latex_file(Path(job.basename).stem, basepath=td)
+        job.color_dict.extract_defs(tex_file, td, None)
+        annotate_file(tex_file, job.color_dict, latex_context=None, basepath=td)
+        postprocess_latex(tex_file)
+        shutil.make_archive(job.output/job.name, 'zip', td) # save annotated files for debugging
+
+        # the black variant is annotated right away, so that both compiles can run concurrently
+        job.td_black = tempfile.TemporaryDirectory()
+        td_black = job.td_black.name
+        job.tree.write_to(td_black, link_from=td)
+        color_dict = ColorAnnotation()
+        color_dict.black = True
+        tex_file = find_latex_file(Path(job.basename).stem, basepath=td_black)
+        annotate_file(tex_file, color_dict, latex_context=None, basepath=td_black)
+        postprocess_latex(tex_file)
+        return job
+
+    def compile_annotated(self, job: PaperJob):
+        job.black = self.black_compiles.submit(self.compile_black, job)
+        with self.containers.lease() as port:
+            job.basename, job.pdf_bytes = compile_pdf_return_bytes(sources_dir=job.td.name, port=port, aux_key=job.name+'-colored', seed_key=job.name+'-plain')
+            job.color_dict.port = port
+            job.color_dict.run_standardize_tex()
+        return job
+
+    def extract_annotated(self, job: PaperJob):
+        job.shapes, job.tokens = self.processes.submit(pdf_extract, job.pdf_bytes).result()
+        return job
+
+    def export(self, job: PaperJob):
+        df_toc, df_data = export_annotation(job.shapes, job.tokens, job.color_dict)
+        df_toc.to_csv(job.output/(job.name+'_toc.csv'), sep='\t')
+        df_data.to_csv(job.output/(job.name+'_data.csv'), sep='\t')
+        job.shapes = job.tokens = None
+        job.black.result() # re-raises errors of the black compile
+        return job
+
+    def compile_black(self, job: PaperJob):
+        _, pdf_bytes = self.compile(job.td_black.name, job.name+'-black', job.name+'-plain')
+        with fitz.open("pdf", pdf_bytes) as doc:
+            doc.save(job.output/(job.name+'.pdf'))
+
+    def done(self, job: PaperJob):
+        job.cleanup()
+        with self._lock:
+            self.finished += 1
+        print("Finished task:{0} ({1})".format(self.finished, job.name))
+
+    def error(self, job: PaperJob, stage: str, e: Exception):
+        if job.black is not None:
+            job.black.exception() # wait for the black compile before removing its sources
+        job.cleanup()
+        with self._lock:
+            self.finished += 1
+        if isinstance(e, CompilationException):
+            message = 'LaTeX code compilation error.'
+        else:
+            message = str(e)
+        logger.error(job.filename.name + '\t' + stage + '\t' + message + '\n')
+        print('error:', job.filename, stage, message)
+
+    def run(self, jobs):
+        try:
+            self.pipeline.run(jobs)
+        finally:
+            # black compiles of jobs that failed later stages may still be running
+            self.black_compiles.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    set_start_method("spawn")
+    parser = ArgumentParser(description="Annotate arXiv source packages with a stage pipeline.")
+    parser.add_argument("--input", default="downloaded", help="Directory with the *.gz sources.")
+    parser.add_argument("--output", default="outputs")
+    parser.add_argument("--containers", type=int, default=16, help="Number of compile containers.")
+    parser.add_argument("--processes", type=int, default=16, help="Processes for PDF extraction.")
+    parser.add_argument("--load-workers", type=int, default=2)
+    parser.add_argument("--compile-workers", type=int, default=16)
+    parser.add_argument("--extract-workers", type=int, default=16)
+    parser.add_argument("--annotate-workers", type=int, default=4)
+    parser.add_argument("--export-workers", type=int, default=2)
+    parser.add_argument("--ready-timeout", type=float, default=READY_TIMEOUT) # seconds per container warm-up
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    output_path = Path(args.output)
+    output_path.mkdir(exist_ok=True)
+    ledger = JobLedger(output_path/'ledger.db')
+    skip = ledger.to_skip(['export']) # finished or permanently failed papers
+    jobs = [
+        PaperJob(filename, output_path) for filename in input_path.glob('*.gz')
+        if filename.stem not in skip
+    ]
+    print('Find %d source files, starting annotate.' %len(jobs))
+    import docker
+    client = docker.from_env()
+    try:
+        client.images.get('tex-compilation-service:latest')
+    except docker.errors.ImageNotFound:
+        print('Docker image not found, compiling... \n It takes ~10 min.')
+        client.images.build(path='texcompile/service', tag='tex-compilation-service')
+    containers = ContainerPool(args.containers, ready_timeout=args.ready_timeout).start()
+    try:
+        with ProcessPoolExecutor(max_workers=args.processes) as processes:
+            AnnotatePipeline(
+                containers, processes, ledger,
+                load_workers=args.load_workers,
+                compile_workers=args.compile_workers,
+                extract_workers=args.extract_workers,
+                annotate_workers=args.annotate_workers,
+                export_workers=args.export_workers,
+            ).run(jobs)
+    finally:
+        containers.stop()
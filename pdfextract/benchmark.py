@@ -0,0 +1,116 @@
+"""
+Compare the extraction engines of pdf_extract on compiled papers, for throughput and for
+agreement of their tokens and shapes:
+
+    python -m pdfextract.benchmark outputs/*.pdf
+
+Tokens of the two engines are matched per page by text and box overlap; the agreement of
+the matched pairs is then reported per field. The "pdfplumber" engine is the reference.
+"""
+import time
+from argparse import ArgumentParser
+from collections import defaultdict
+from io import BytesIO
+from pathlib import Path
+
+import fitz
+
+from pdfextract.pdf_extract import ENGINES, extract_pages
+
+MIN_IOU = 0.5
+
+
+def iou(a, b) -> float:
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_tokens(reference, candidate):
+    """
+    Pairs of tokens on the same page with the same text whose boxes overlap by at least
+    MIN_IOU, each token used once.
+    """
+    by_key = defaultdict(list)
+    for token in candidate:
+        by_key[(token["page_no"], token["text"])].append(token)
+    pairs = []
+    for token in reference:
+        options = by_key.get((token["page_no"], token["text"]), [])
+        best, best_iou = None, MIN_IOU
+        for option in options:
+            overlap = iou(token["bbox"], option["bbox"])
+            if overlap >= best_iou:
+                best, best_iou = option, overlap
+        if best is not None:
+            options.remove(best)
+            pairs.append((token, best))
+    return pairs
+
+
+def shape_keys(shapes):
+    return {
+        (s["page_number"], tuple(round(s[k]) for k in ("x0", "y0", "x1", "y1")), s["stroking_color"])
+        for s in shapes
+    }
+
+
+def benchmark(filename: Path, repeat: int):
+    pdf_bytes = filename.read_bytes()
+    with fitz.open("pdf", pdf_bytes) as doc:
+        pages = doc.page_count
+    results, seconds = {}, {}
+    for engine in ENGINES:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            results[engine] = extract_pages(BytesIO(pdf_bytes), engine=engine)
+        seconds[engine] = (time.perf_counter() - started) / repeat
+
+    (ref_shapes, ref_tokens), (shapes, tokens) = results["pdfplumber"], results["pymupdf"]
+    pairs = match_tokens(ref_tokens, tokens)
+    agree = {
+        field: sum(a[field] == b[field] for a, b in pairs) / max(len(pairs), 1)
+        for field in ("color", "font", "font_size", "flags", "line_no")
+    }
+    ref_keys, keys = shape_keys(ref_shapes), shape_keys(shapes)
+    return {
+        "pages": pages,
+        "seconds": seconds,
+        "tokens": (len(ref_tokens), len(tokens)),
+        "recall": len(pairs) / max(len(ref_tokens), 1),
+        "precision": len(pairs) / max(len(tokens), 1),
+        "agree": agree,
+        "shapes": (len(ref_shapes), len(shapes)),
+        "shape_recall": len(ref_keys & keys) / max(len(ref_keys), 1),
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("pdfs", type=Path, nargs="+")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    total_pages = 0
+    total_seconds = defaultdict(float)
+    for filename in args.pdfs:
+        r = benchmark(filename, args.repeat)
+        total_pages += r["pages"]
+        for engine, seconds in r["seconds"].items():
+            total_seconds[engine] += seconds
+        print('%s: %d pages, %s' % (filename.name, r["pages"], ', '.join(
+            '%s %.2fs' % (engine, seconds) for engine, seconds in r["seconds"].items())))
+        print('  tokens %d / %d, recall %.3f, precision %.3f, shapes %d / %d, shape recall %.3f' % (
+            r["tokens"] + (r["recall"], r["precision"]) + r["shapes"] + (r["shape_recall"],)))
+        print('  agreement of matched tokens: ' + ', '.join(
+            '%s %.3f' % (field, rate) for field, rate in r["agree"].items()))
+    for engine, seconds in total_seconds.items():
+        print('%s: %.1f pages/s' % (engine, total_pages / seconds if seconds else float('inf')))
+
+
+if __name__ == "__main__":
+    main()
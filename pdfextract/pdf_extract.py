@@ -1,20 +1,39 @@
+import os
+import tempfile
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Optional
 import fitz
+import numpy as np
 import pdfplumber
 from matplotlib.colors import to_hex
-import numpy as np
+
+GRID_CELL = 32 # points; about three lines of body text
+ENGINES = ("pdfplumber", "pymupdf")
+PARALLEL_MIN_PAGES = 8
+" Shorter PDFs are extracted sequentially: splitting them saves less than the workers' setup. "
+LIGATURES = {"\ufb00": "ff", "\ufb03": "ffi", "\ufb04": "ffl", "\ufb01": "fi", "\ufb02": "fl", "\ufb06": "st", "\ufb05": "st"}
+" Expanded like pdfplumber's extract_words(expand_ligatures=True). "
+
+
+def extract_page_shapes(page) -> list:
+    ret = []
+    for rect in page.rects:
+        r = rect
+        r['y0'] = page.height - rect['y1']
+        r['y1'] = r['y0'] + rect['height']
+        r['page_size'] = [page.height, page.width]
+        ret.append(r)
+    return ret
 
 
 def extract_shapes(pdf_bytes: bytes):
     ret = []
     with pdfplumber.open(pdf_bytes) as doc:
-        rects = doc.rects
-        for rect in rects:
-            page = doc.pages[rect['page_number']-1]
-            r = rect
-            r['y0'] = page.height - rect['y1']
-            r['y1'] = r['y0'] + rect['height']
-            r['page_size'] = [page.height, page.width]
-            ret.append(r)
+        for page in doc.pages:
+            ret.extend(extract_page_shapes(page))
     return ret
 
 
@@ -60,64 +79,312 @@ def convert_color(non_stroking_color):
         return to_hex(non_stroking_color)
 
 
-def select_token(page_dic: dict, rect: fitz.Rect) -> dict:
-    blocks = []
-    for block in page_dic["blocks"]:
-        blocks.append(fitz.Rect(block['bbox']).intersect(rect).get_area())
-    block = page_dic["blocks"][np.argmax(blocks)]
-    lines = []
-    for line in block["lines"]:
-        lines.append(fitz.Rect(line['bbox']).intersect(rect).get_area())
-    line = block["lines"][np.argmax(lines)]
-    spans = []
-    for span in line["spans"]:
-        spans.append(fitz.Rect(span['bbox']).intersect(rect).get_area())
-    span = line["spans"][np.argmax(spans)]
-    return span
+class LineIndex:
+    """
+    Line boxes of a page sorted by their top edge. A token belongs to a line if the line's box
+    contains the token's centre (see token_in_bbox); only lines whose top lies within one
+    line height above the centre can, so they are found by bisection. If several lines match,
+    the last one in page order wins, as when all lines were scanned.
+    """
+    def __init__(self, lines_bbox):
+        order = sorted(range(len(lines_bbox)), key=lambda i: lines_bbox[i][1])
+        self.tops = [lines_bbox[i][1] for i in order]
+        self.lines = [(i, lines_bbox[i]) for i in order]
+        self.max_height = max((bbox[3] - bbox[1] for bbox in lines_bbox), default=0)
+
+    def find(self, token):
+        v_mid = (token["top"] + token["bottom"]) / 2
+        lo = bisect_right(self.tops, v_mid - self.max_height)
+        hi = bisect_right(self.tops, v_mid)
+        line_no = None
+        for i, bbox in self.lines[lo:hi]:
+            if token_in_bbox(token, bbox) and (line_no is None or i > line_no):
+                line_no = i
+        return line_no
+
+
+class SpanIndex:
+    """
+    Text spans of a page, bucketed into a grid of GRID_CELL points, so that a word is only
+    compared with the spans in the cells its box covers instead of laying out the page again.
+    """
+    def __init__(self, page_dic: dict, cell: float = GRID_CELL):
+        self.cell = cell
+        self.spans = []
+        self.grid = defaultdict(list)
+        for block in page_dic["blocks"]:
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    for key in self._cells(span["bbox"]):
+                        self.grid[key].append(len(self.spans))
+                    self.spans.append(span)
+
+    def _cells(self, bbox):
+        x0, y0, x1, y1 = bbox
+        for cx in range(int(x0 // self.cell), int(x1 // self.cell) + 1):
+            for cy in range(int(y0 // self.cell), int(y1 // self.cell) + 1):
+                yield cx, cy
+
+    def select(self, bbox):
+        """
+        The span with the largest overlap with `bbox`, the first one in reading order on
+        ties. None if no span touches it.
+        """
+        candidates = set()
+        for key in self._cells(bbox):
+            candidates.update(self.grid.get(key, ()))
+        x0, y0, x1, y1 = bbox
+        best, best_area = None, -1.0
+        for i in sorted(candidates):
+            sx0, sy0, sx1, sy1 = self.spans[i]["bbox"]
+            w = min(x1, sx1) - max(x0, sx0)
+            h = min(y1, sy1) - max(y0, sy0)
+            if w < 0 or h < 0:
+                continue
+            if w * h > best_area:
+                best, best_area = self.spans[i], w * h
+        return best
+
+
+def extract_page_tokens(page, fitz_page) -> list:
+    tokens = []
+    lines_bbox = []
+    blocks = fitz_page.get_text("dict", flags=11)["blocks"]
+    for b in blocks:  # iterate through the text blocks
+        for l in b["lines"]:  # iterate through the text lines
+            lines_bbox.append(l["bbox"])
+    lines = LineIndex(lines_bbox)
+
+    spans = SpanIndex(fitz_page.get_text("dict", flags=fitz.TEXT_PRESERVE_LIGATURES|fitz.TEXT_PRESERVE_WHITESPACE))
+
+    texts = page.extract_words(x_tolerance=3, y_tolerance=3, keep_blank_chars=False, use_text_flow=True, horizontal_ltr=True, vertical_ttb=True, extra_attrs=["fontname", "size", "non_stroking_color", "y0", "y1"], split_at_punctuation=False, expand_ligatures=True)
+    for token in texts:
+        bbox = (token["x0"], token["top"], token["x1"], token["bottom"])
+        s = spans.select(bbox)
+        if s is None:
+            continue
+
+        line_no = lines.find(token)
+        if not line_no is None:
+            tokens.append({
+                "page_no": page.page_number,
+                "text": token["text"],
+                "font": s["font"],
+                "font_size": s["size"],
+                "color": convert_color(token["non_stroking_color"]),
+                "bbox": bbox,
+                "page_size": [page.height, page.width],
+                "flags": flags_decomposer(s["flags"]),
+                "line_no": line_no
+            })
+        else:
+            raise "token does not belong to any line, please check cropbox."
+    return tokens
+
+
+def pdf_number(value: float) -> float:
+    """
+    The number written in the PDF for a float32 MuPDF reports, i.e. the shortest decimal that
+    rounds to it. pdfminer parses that decimal, so both engines see the same components.
+    """
+    return float(str(np.float32(value)))
+
+
+def round_color(color):
+    if color is None:
+        return None
+    return tuple(pdf_number(c) for c in color)
+
+
+def char_colors(fitz_page) -> dict:
+    """
+    Fill color components of the characters of a page, by origin. The spans of rawdict only
+    carry MuPDF's sRGB integer, which rounds halves up where to_hex rounds them to even (0.3
+    gives 0x4d instead of 0x4c), so token colors are derived from these as in pdfplumber.
+    """
+    colors = {}
+    for trace in fitz_page.get_texttrace():
+        color = round_color(trace["color"])
+        for char in trace["chars"]:
+            colors[char[2]] = color
+    return colors
+
+
+def extract_page_shapes_pymupdf(fitz_page) -> list:
+    """
+    Rectangles of a page as extract_page_shapes returns them, from PyMuPDF's drawings.
+    MuPDF only reports the stroke color of stroked paths, so filled rectangles take their
+    fill color instead; LaTeX's \\color sets both to the same value.
+    """
+    ret = []
+    page_size = [fitz_page.rect.height, fitz_page.rect.width]
+    for path in fitz_page.get_drawings():
+        stroke, fill = path.get("color"), path.get("fill")
+        for item in path["items"]:
+            if item[0] != "re":
+                continue
+            rect = item[1]
+            ret.append({
+                "page_number": fitz_page.number + 1,
+                "x0": rect.x0, "y0": rect.y0, "x1": rect.x1, "y1": rect.y1,
+                "top": rect.y0, "bottom": rect.y1,
+                "width": rect.width, "height": rect.height,
+                "stroke": stroke is not None, "fill": fill is not None,
+                "stroking_color": round_color(stroke if stroke is not None else fill),
+                "non_stroking_color": round_color(fill),
+                "linewidth": path.get("width"),
+                "page_size": page_size,
+            })
+    return ret
+
+
+def span_words(span, x_tolerance=3):
+    """
+    Split the characters of a rawdict span into words at whitespace and at horizontal gaps
+    larger than `x_tolerance`. Words never cross spans, as pdfplumber splits words where the
+    font, size or color changes. Yields (text, bbox) pairs.
+    """
+    text, bbox = [], None
+    for char in span["chars"]:
+        x0, top, x1, bottom = char["bbox"]
+        if char["c"].isspace() or (bbox is not None and x0 - bbox[2] > x_tolerance):
+            if text:
+                yield "".join(text), tuple(bbox)
+            text, bbox = [], None
+            if char["c"].isspace():
+                continue
+        text.append(LIGATURES.get(char["c"], char["c"]))
+        if bbox is None:
+            bbox = [x0, top, x1, bottom]
+        else:
+            bbox = [min(bbox[0], x0), min(bbox[1], top), max(bbox[2], x1), max(bbox[3], bottom)]
+    if text:
+        yield "".join(text), tuple(bbox)
+
+
+def extract_page_tokens_pymupdf(fitz_page) -> list:
+    """
+    Tokens of a page as extract_page_tokens returns them, built from the characters of
+    PyMuPDF's spans, which carry the fill color, font, size and flags, without pdfminer.
+    """
+    tokens = []
+    page_dic = fitz_page.get_text("rawdict", flags=11) # the layout the line boxes come from
+    lines_bbox = []
+    for b in page_dic["blocks"]:
+        for l in b["lines"]:
+            lines_bbox.append(l["bbox"])
+    lines = LineIndex(lines_bbox)
+    page_size = [fitz_page.rect.height, fitz_page.rect.width]
+    colors = char_colors(fitz_page)
+
+    own_line = 0
+    for b in page_dic["blocks"]:
+        for l in b["lines"]:
+            for span in l["spans"]:
+                color = colors.get(span["chars"][0]["origin"]) if span["chars"] else None
+                color = "#%06x" % span["color"] if color is None else convert_color(color)
+                for text, bbox in span_words(span):
+                    x0, top, x1, bottom = bbox
+                    line_no = lines.find({"x0": x0, "top": top, "x1": x1, "bottom": bottom})
+                    tokens.append({
+                        "page_no": fitz_page.number + 1,
+                        "text": text,
+                        "font": span["font"],
+                        "font_size": span["size"],
+                        "color": color,
+                        "bbox": bbox,
+                        "page_size": page_size,
+                        "flags": flags_decomposer(span["flags"]),
+                        "line_no": own_line if line_no is None else line_no,
+                    })
+            own_line += 1
+    return tokens
+
+
+def open_fitz(pdf):
+    if isinstance(pdf, str):
+        return fitz.open(pdf)
+    return fitz.open("pdf", pdf)
 
 
 def extract_tokens(pdf_bytes: bytes):
     tokens = []
     with pdfplumber.open(pdf_bytes) as doc:
-        with fitz.open("pdf", pdf_bytes) as fitz_doc:
+        with open_fitz(pdf_bytes) as fitz_doc:
             for page in doc.pages:
-                lines_bbox = []
-                fitz_page = fitz_doc[page.page_number-1]
-                blocks = fitz_page.get_text("dict", flags=11)["blocks"]
-                for b in blocks:  # iterate through the text blocks
-                    for l in b["lines"]:  # iterate through the text lines
-                        lines_bbox.append(l["bbox"])
-
-                texts = page.extract_words(x_tolerance=3, y_tolerance=3, keep_blank_chars=False, use_text_flow=True, horizontal_ltr=True, vertical_ttb=True, extra_attrs=["fontname", "size", "non_stroking_color", "y0", "y1"], split_at_punctuation=False, expand_ligatures=True)
-                for token in texts:
-                    bbox = (token["x0"], token["top"], token["x1"], token["bottom"])
-                    rect_from_pdfplumber = fitz.Rect(bbox)
-                    page_dic = fitz_page.get_text("dict", clip=fitz.Rect(bbox), flags=fitz.TEXT_PRESERVE_LIGATURES|fitz.TEXT_PRESERVE_WHITESPACE) # ["blocks"][0]["lines"][0]["spans"][0]
-                    if page_dic["blocks"]:
-                        s = select_token(page_dic, rect_from_pdfplumber)
-                    else:
-                        continue
-
-                    line_no = None
-                    for i, line_bbox in enumerate(lines_bbox):
-                        if token_in_bbox(token, line_bbox):
-                            line_no = i
-                    if not line_no is None:
-                        tokens.append({
-                            "page_no": page.page_number,
-                            "text": token["text"],
-                            "font": s["font"],
-                            "font_size": s["size"],
-                            "color": convert_color(token["non_stroking_color"]),
-                            "bbox": bbox,
-                            "page_size": [page.height, page.width],
-                            "flags": flags_decomposer(s["flags"]),
-                            "line_no": line_no
-                        })
-                    else:
-                        raise "token does not belong to any line, please check cropbox."
+                tokens.extend(extract_page_tokens(page, fitz_doc[page.page_number-1]))
     return tokens
 
 
-def pdf_extract(pdf_bytes: bytes):
-    return extract_shapes(pdf_bytes), extract_tokens(pdf_bytes)
\ No newline at end of file
+def extract_pages(pdf, pages=None, engine="pdfplumber"):
+    """
+    Shapes and tokens of the given 1-based `pages` (all by default) of a PDF file or stream.
+    With the "pdfplumber" engine, both documents are opened once and each page is laid out by
+    pdfminer a single time: pdfplumber caches the page objects that rects and words are built
+    from, and the cache is dropped once the page is done. The "pymupdf" engine reads
+    everything from PyMuPDF.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown extraction engine %r, expected one of %s." % (engine, ENGINES))
+    shapes, tokens = [], []
+    if engine == "pymupdf":
+        with open_fitz(pdf) as fitz_doc:
+            for page_number in pages or range(1, fitz_doc.page_count + 1):
+                fitz_page = fitz_doc[page_number-1]
+                shapes.extend(extract_page_shapes_pymupdf(fitz_page))
+                tokens.extend(extract_page_tokens_pymupdf(fitz_page))
+        return shapes, tokens
+    with pdfplumber.open(pdf, pages=pages) as doc:
+        with open_fitz(pdf) as fitz_doc:
+            for page in doc.pages:
+                shapes.extend(extract_page_shapes(page))
+                tokens.extend(extract_page_tokens(page, fitz_doc[page.page_number-1]))
+                page.flush_cache()
+    return shapes, tokens
+
+
+def pdf_extract(
+    pdf_bytes: bytes, workers: int = 1, engine: str = "pdfplumber",
+    executor: Optional[Executor] = None,
+):
+    """
+    Shapes and tokens of a PDF, in page order. `engine` is "pdfplumber" (words and colors from
+    pdfminer, fonts from PyMuPDF) or "pymupdf" (everything from PyMuPDF, without pdfminer);
+    `python -m pdfextract.benchmark` compares the two. With `workers` > 1 the pages are split
+    into contiguous ranges that are extracted by a pool of processes; the PDF is written once
+    to a file in memory (/dev/shm) that every worker opens, instead of being pickled to each.
+    Pass a long-lived process pool as `executor` to extract many PDFs; otherwise one is
+    started for the call. PDFs of fewer than PARALLEL_MIN_PAGES pages are extracted in place.
+    Line numbers count per page, so the merged result is the same as a sequential run.
+    """
+    if workers <= 1:
+        return extract_pages(pdf_bytes, engine=engine)
+    with open_fitz(pdf_bytes) as fitz_doc:
+        page_count = fitz_doc.page_count
+    if page_count < PARALLEL_MIN_PAGES:
+        return extract_pages(pdf_bytes, engine=engine)
+
+    # a few more ranges than workers, so that one slow range does not hold up the others
+    chunks = min(page_count, workers * 2)
+    bounds = [page_count * i // chunks for i in range(chunks + 1)]
+    data = pdf_bytes.getvalue() if hasattr(pdf_bytes, 'getvalue') else pdf_bytes
+    shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=shm) as td:
+        filename = os.path.join(td, 'paper.pdf')
+        with open(filename, 'wb') as f:
+            f.write(data)
+        with ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(max_workers=min(workers, chunks))
+                )
+            futures = [
+                executor.submit(extract_pages, filename, list(range(first + 1, last + 1)), engine)
+                for first, last in zip(bounds, bounds[1:])
+            ]
+            shapes, tokens = [], []
+            for future in futures: # submission order is page order
+                page_shapes, page_tokens = future.result()
+                shapes.extend(page_shapes)
+                tokens.extend(page_tokens)
+    return shapes, tokens
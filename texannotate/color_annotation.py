@@ -134,6 +134,7 @@ class ColorAnnotation:
         self.defs = None
         self.td = None
         self.port = None
+        self.balancer = None
         self._standardize_tex_queue = {}
         self.documentclass = None
 
@@ -180,9 +181,10 @@ class ColorAnnotation:
     def add_existing_color(self, color_str):
         self.color_dict[color_str] = None
 
-    def extract_defs(self, filename, td, port):
+    def extract_defs(self, filename, td, port, balancer=None):
         self.td = td
         self.port = port
+        self.balancer = balancer # if set, LaTeXML runs on its least-loaded endpoint instead
         self.defs = read_preamble(filename, td)
 
     def standardize_tex_queue(self, tex_string, hex_string):
@@ -200,7 +202,10 @@ class ColorAnnotation:
             tex_string += v
         with open(os.path.join(self.td, latexml_file_name), 'w') as f:
             f.write(self.defs+tex_string+"\n\\end{document}")
-        html_text = compile_html_return_text(main_tex=latexml_file_name, sources_dir=self.td, port=self.port)
+        if self.balancer is not None:
+            html_text = self.balancer.call(compile_html_return_text, main_tex=latexml_file_name, sources_dir=self.td)
+        else:
+            html_text = compile_html_return_text(main_tex=latexml_file_name, sources_dir=self.td, port=self.port)
         doc = parse_latexml(html_text)
         for element in doc.children:
             if isinstance(element, Section):
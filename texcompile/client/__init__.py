@@ -1,40 +1,33 @@
 import base64
+import json
 import logging
 import os
 import os.path
 import posixpath
-import tarfile
+import time
 from dataclasses import dataclass
 from io import BytesIO
-from sys import platform
-from typing import Dict, List
-import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
 
 import requests
+
 from typing_extensions import Literal
 
-logger = logging.getLogger("texcompile-client")
+from . import archive
+from .archive import archive_request
+from .balancer import Balancer, get_default_balancer, set_default_balancer
+from .cache import CompileCache, get_default_cache, set_default_cache
+from .exceptions import (
+    CircuitOpenException, CompilationException, ConnectionFailedException,
+    ServerConnectionException, ServiceBusyException,
+)
+from .transport import post, request
 
-if platform == "linux" or platform == "linux2":
-    try:
-        from memory_tempfile import MemoryTempfile
-        tempfile = MemoryTempfile()
-    except:
-        import tempfile
-else:
-    import tempfile
+logger = logging.getLogger("texcompile-client")
 
 Path = str
 
 
-class ServerConnectionException(Exception):
-    pass
-
-
-class CompilationException(Exception):
-    pass
-
-
 @dataclass
 class OutputFile:
     type_: Literal["pdf", "ps"]
@@ -59,34 +52,67 @@ class Result:
         )
 
 
-def send_request(sources_dir, host, port, autotex_or_latexml, main_tex=' ') -> dict:
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Prepare a gzipped tarball file containing the sources.
-        archive_filename = os.path.join(temp_dir, "archive.tgz")
-        with tarfile.open(archive_filename, "w:gz") as archive:
-            archive.add(sources_dir, arcname=os.path.sep)
-
-        # Prepare query parameters.
-        with open(archive_filename, "rb") as archive_file:
-            files = {"sources": ("archive.tgz", archive_file, "multipart/form-data")}
-            data = {"autotex_or_latexml": autotex_or_latexml, "main_tex_file": main_tex}
-            if autotex_or_latexml == "latexml":
-                assert main_tex, "No main .tex file specified."
-            # Make request to service.
-            endpoint = f"{host}:{port}/"
-            try:
-                response = requests.post(endpoint, files=files, data=data)
-                while response.status_code == 104:
-                    response = requests.post(endpoint, files=files, data=data)
-            except requests.exceptions.RequestException as e:
-                raise ServerConnectionException(
-                    f"Request to server {endpoint} failed.", e
-                )
+RESULT_HEADER = "X-Texcompile-Result"
+
+
+def post_sources(
+    sources_dir, host, port, autotex_or_latexml, main_tex=' ', compresslevel=None,
+    response_format="json", aux_key=None, seed_key=None,
+) -> requests.Response:
+    data = {
+        "autotex_or_latexml": autotex_or_latexml,
+        "main_tex_file": main_tex,
+        "response_format": response_format,
+    }
+    if aux_key:
+        data["aux_key"] = aux_key
+    if seed_key:
+        data["seed_key"] = seed_key
+    if autotex_or_latexml == "latexml":
+        assert main_tex, "No main .tex file specified."
+    if compresslevel is None:
+        compresslevel = archive.COMPRESSLEVEL
+
+    # The archive is streamed into the request body, and rebuilt if the request is retried.
+    def make_request():
+        return archive_request(sources_dir, data, compresslevel)
+
+    # Make request to service.
+    endpoint = f"{host}:{port}/"
+    return post(endpoint, make_request)
+
+
+def send_request(
+    sources_dir, host, port, autotex_or_latexml, main_tex=' ', compresslevel=None
+) -> dict:
+    response = post_sources(sources_dir, host, port, autotex_or_latexml, main_tex, compresslevel)
 
     # Get result
     return response.json()
 
 
+def parse_primary_output(headers: Mapping[str, str], content: bytes, type_: str) -> Tuple[str, bytes]:
+    """
+    Get the path and contents of the main output file from a service response. Binary
+    responses carry the file as the body and metadata in a header; JSON responses (failures,
+    or services without binary support) carry base64-encoded outputs and the log.
+    """
+    if RESULT_HEADER in headers:
+        meta = json.loads(headers[RESULT_HEADER])
+        return meta["path"], content
+
+    data = json.loads(content)
+    # Check success.
+    if not (data["success"] or data["has_output"]):
+        raise CompilationException(data["log"])
+
+    for output in data["output"]:
+        if output["type"] == type_ and output["contents"]:
+            return output["path"], base64.b64decode(output["contents"])
+
+    raise CompilationException(f"No {type_} output.")
+
+
 def compile_pdf(
     sources_dir: Path,
     output_dir: Path,
@@ -138,41 +164,209 @@ def compile_pdf_return_bytes(
     sources_dir: Path,
     host: str = "http://127.0.0.1",
     port: int = 8000,
+    cache: Optional[CompileCache] = None,
+    aux_key: Optional[str] = None,
+    seed_key: Optional[str] = None,
 ) -> Result:
-    
-    data = send_request(sources_dir, host, port, "autotex")
+    """
+    Compile the sources and return the name and contents of the first PDF. If a cache is
+    passed or a default cache is configured (see `set_default_cache`), an unchanged source
+    tree is served from the cache without contacting the service. The service keeps the
+    .aux/.bbl files of the compile under `aux_key` (e.g. the arXiv id and the variant
+    compiled) and seeds it with those kept under `seed_key` (by default `aux_key`), e.g. of
+    the paper's plain variant, which saves LaTeX passes.
+    """
+    cache = cache or get_default_cache()
+    if cache is not None:
+        key = cache.key(sources_dir, "autotex")
+        hit = cache.get(key)
+        if hit is not None:
+            meta, contents = hit
+            return meta["basename"], BytesIO(contents)
+
+    response = post_sources(
+        sources_dir, host, port, "autotex", response_format="binary", aux_key=aux_key,
+        seed_key=seed_key,
+    )
+    path, contents = parse_primary_output(response.headers, response.content, "pdf")
+    basename = posixpath.basename(path)
+    if cache is not None:
+        cache.put(key, {"basename": basename}, contents)
+    # BytesIO shares the buffer of the immutable response body instead of copying it.
+    return basename, BytesIO(contents)
 
-    # Check success.
-    if not (data["success"] or data["has_output"]):
-        raise CompilationException(data["log"])
 
-    for i, output in enumerate(data["output"]):
-        type_ = output["type"]
-        if type_ == 'pdf':
-            basename = posixpath.basename(output["path"])
-            base64_contents = output["contents"]
-            contents = base64.b64decode(base64_contents)
-            return basename, BytesIO(contents)
-
-    raise CompilationException('No pdf output.')
-    
 def compile_html_return_text(
     main_tex: str,
     sources_dir: Path,
     host: str = "http://127.0.0.1",
     port: int = 8000,
+    cache: Optional[CompileCache] = None,
 ) -> str:
-    data = send_request(sources_dir, host, port, "latexml", main_tex)
+    cache = cache or get_default_cache()
+    if cache is not None:
+        key = cache.key(sources_dir, "latexml", main_tex)
+        hit = cache.get(key)
+        if hit is not None:
+            return hit[1].decode("utf-8")
+
+    response = post_sources(
+        sources_dir, host, port, "latexml", main_tex, response_format="binary"
+    )
+    path, contents = parse_primary_output(response.headers, response.content, "html")
+    if cache is not None:
+        cache.put(key, {"path": path}, contents)
+    return contents.decode("utf-8")
 
-    # Check success.
-    if not (data["success"] or data["has_output"]):
-        raise CompilationException(data["log"])
 
-    for i, output in enumerate(data["output"]):
-        type_ = output["type"]
-        if type_ == 'html':
-            base64_contents = output["contents"]
-            contents = base64.b64decode(base64_contents).decode("utf-8")
-            return contents
+def submit_job(
+    sources_dir: Path,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    autotex_or_latexml: str = "autotex",
+    main_tex: str = " ",
+    compresslevel: Optional[int] = None,
+    aux_key: Optional[str] = None,
+    seed_key: Optional[str] = None,
+) -> str:
+    """
+    Start an asynchronous compile and return its job id. Unlike `compile_pdf`, no connection
+    is held open while the service compiles; poll with `job_status` or `wait_for_job` and
+    fetch the result with `job_output`.
+    """
+    data = {"autotex_or_latexml": autotex_or_latexml, "main_tex_file": main_tex}
+    if aux_key:
+        data["aux_key"] = aux_key
+    if seed_key:
+        data["seed_key"] = seed_key
+    if compresslevel is None:
+        compresslevel = archive.COMPRESSLEVEL
+
+    def make_request():
+        return archive_request(sources_dir, data, compresslevel)
+
+    response = post(f"{host}:{port}/jobs", make_request)
+    return response.json()["id"]
+
+
+def job_status(
+    job_id: str, host: str = "http://127.0.0.1", port: int = 8000, log_lines: int = 50
+) -> dict:
+    """
+    State ('queued', 'running', 'done' or 'failed') of a job, with the tail of the log once
+    the compile is done.
+    """
+    response = request(
+        "GET", f"{host}:{port}/jobs/{job_id}", lambda: {"params": {"log_lines": log_lines}}
+    )
+    return response.json()
+
+
+def wait_for_job(
+    job_id: str,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    poll_interval: float = 2.0,
+    timeout: Optional[float] = None,
+) -> dict:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        status = job_status(job_id, host, port)
+        if status["state"] in ("done", "failed"):
+            return status
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Job {job_id} is still {status['state']} after {timeout}s.")
+        time.sleep(poll_interval)
+
+
+def job_output(
+    job_id: str,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    type_: str = "pdf",
+    delete: bool = True,
+) -> Tuple[str, bytes]:
+    """
+    Get the path and contents of the main output of a finished job, raising
+    `CompilationException` if there is none. The job is deleted on the service afterwards
+    unless `delete` is False.
+    """
+    endpoint = f"{host}:{port}/jobs/{job_id}"
+    response = request("GET", endpoint + "/output")
+    try:
+        return parse_primary_output(response.headers, response.content, type_)
+    finally:
+        if delete:
+            request("DELETE", endpoint)
+
+
+def create_workspace(
+    sources_dir: Path,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    compresslevel: Optional[int] = None,
+) -> str:
+    """
+    Upload the original sources of a paper once and return the workspace id. Compile variants
+    of the paper are then sent to the same service with `compile_workspace_pdf`, as overlays
+    of the files that differ from the original.
+    """
+    if compresslevel is None:
+        compresslevel = archive.COMPRESSLEVEL
+    response = post(
+        f"{host}:{port}/workspaces", lambda: archive_request(sources_dir, {}, compresslevel)
+    )
+    return response.json()["id"]
+
+
+def compile_workspace_pdf(
+    workspace_id: str,
+    changes: Mapping[str, bytes],
+    deleted: Iterable[str] = (),
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    aux_key: Optional[str] = None,
+    seed_key: Optional[str] = None,
+    sources_dir: Optional[Path] = None,
+    cache: Optional[CompileCache] = None,
+) -> Tuple[str, BytesIO]:
+    """
+    Compile the workspace's sources with `changes` (relative POSIX paths to contents) written
+    over them and `deleted` paths removed. Returns the name and contents of the first PDF,
+    like `compile_pdf_return_bytes`. The service only sees the overlay, so the compile cache
+    is consulted only if `sources_dir` holds the resulting tree; its entries are shared with
+    `compile_pdf_return_bytes`.
+    """
+    cache = cache or get_default_cache()
+    if sources_dir is None:
+        cache = None
+    if cache is not None:
+        key = cache.key(sources_dir, "autotex")
+        hit = cache.get(key)
+        if hit is not None:
+            meta, contents = hit
+            return meta["basename"], BytesIO(contents)
+
+    data = {
+        "autotex_or_latexml": "autotex",
+        "main_tex_file": " ",
+        "response_format": "binary",
+        "deleted": json.dumps(list(deleted)),
+    }
+    if aux_key:
+        data["aux_key"] = aux_key
+    if seed_key:
+        data["seed_key"] = seed_key
+    response = post(
+        f"{host}:{port}/workspaces/{workspace_id}/compile",
+        lambda: archive.overlay_request(changes, data),
+    )
+    path, contents = parse_primary_output(response.headers, response.content, "pdf")
+    basename = posixpath.basename(path)
+    if cache is not None:
+        cache.put(key, {"basename": basename}, contents)
+    return basename, BytesIO(contents)
+
 
-    raise CompilationException('No pdf output.')
\ No newline at end of file
+def delete_workspace(workspace_id: str, host: str = "http://127.0.0.1", port: int = 8000) -> None:
+    request("DELETE", f"{host}:{port}/workspaces/{workspace_id}")
@@ -0,0 +1,223 @@
+"""
+asyncio counterparts of the blocking client functions, built on httpx. One event loop can keep
+many compile requests in flight, e.g. across several service endpoints, while CPU-bound work
+such as PDF extraction runs in a process pool:
+
+    from texcompile.client import aio
+    basename, pdf_bytes = await aio.compile_pdf_return_bytes(sources_dir, port=port)
+"""
+import asyncio
+import base64
+import logging
+import os
+import os.path
+import posixpath
+import weakref
+from io import BytesIO
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from . import OutputFile, Result, parse_primary_output, transport
+from .archive import archive_request
+from .cache import CompileCache, get_default_cache
+from .exceptions import CompilationException
+
+logger = logging.getLogger("texcompile-client")
+
+Path = str
+
+MAX_CONNECTIONS = 512
+
+_END = object()
+# keyed by the loop itself: ids of closed loops are reused, and clients go away with their loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Shared client with a keep-alive connection pool for the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS, max_keepalive_connections=transport.POOL_MAXSIZE
+            ),
+            timeout=httpx.Timeout(transport.READ_TIMEOUT, connect=transport.CONNECT_TIMEOUT),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose() -> None:
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def _iterate_in_thread(chunks: Iterable[bytes]) -> AsyncIterator[bytes]:
+    " Drive a blocking iterator (the archive builder) from a worker thread. "
+    loop = asyncio.get_running_loop()
+    iterator = iter(chunks)
+    while True:
+        chunk = await loop.run_in_executor(None, next, iterator, _END)
+        if chunk is _END:
+            break
+        yield chunk
+
+
+async def post(
+    endpoint: str, make_request: Callable[[], Dict[str, Any]], retry_busy: bool = True
+) -> httpx.Response:
+    """
+    Same retry, backoff and circuit-breaker policy as `transport.post` (see
+    `transport.RetryPolicy`).
+    """
+    policy = transport.RetryPolicy(endpoint, retry_busy)
+    for delay in policy.delays():
+        await asyncio.sleep(delay)
+        policy.check_circuit()
+        try:
+            response = await get_client().post(endpoint, **make_request())
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+            policy.connection_failed(e)
+            continue
+        except httpx.HTTPError as e:
+            raise policy.request_failed(e)
+        if policy.done(response.status_code, response.content, response.text):
+            return response
+    raise policy.exhausted()
+
+
+async def post_sources(
+    sources_dir, host, port, autotex_or_latexml, main_tex=' ', compresslevel=None,
+    response_format="json", aux_key=None, seed_key=None,
+) -> httpx.Response:
+    data = {
+        "autotex_or_latexml": autotex_or_latexml,
+        "main_tex_file": main_tex,
+        "response_format": response_format,
+    }
+    if aux_key:
+        data["aux_key"] = aux_key
+    if seed_key:
+        data["seed_key"] = seed_key
+    if autotex_or_latexml == "latexml":
+        assert main_tex, "No main .tex file specified."
+
+    def make_request():
+        kwargs = archive_request(sources_dir, data, compresslevel) if compresslevel is not None \
+            else archive_request(sources_dir, data)
+        return {"content": _iterate_in_thread(kwargs["data"]), "headers": kwargs["headers"]}
+
+    endpoint = f"{host}:{port}/"
+    return await post(endpoint, make_request)
+
+
+async def send_request(
+    sources_dir, host, port, autotex_or_latexml, main_tex=' ', compresslevel=None
+) -> dict:
+    response = await post_sources(
+        sources_dir, host, port, autotex_or_latexml, main_tex, compresslevel
+    )
+    return response.json()
+
+
+async def _cache_lookup(
+    cache: Optional[CompileCache], sources_dir: Path, mode: str, main_tex: str = ""
+) -> Tuple[Optional[str], Optional[Tuple[Dict[str, Any], bytes]]]:
+    if cache is None:
+        return None, None
+    # hashing reads the whole tree, so keep it off the event loop
+    key = await asyncio.to_thread(cache.key, sources_dir, mode, main_tex)
+    return key, await asyncio.to_thread(cache.get, key)
+
+
+async def compile_pdf(
+    sources_dir: Path,
+    output_dir: Path,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+) -> Result:
+
+    data = await send_request(sources_dir, host, port, "autotex")
+
+    # Check success.
+    if not (data["success"] or data["has_output"]):
+        raise CompilationException(data["log"])
+
+    output_files: List[OutputFile] = []
+    result = Result(
+        success=data["success"],
+        main_tex_files=data["main_tex_files"],
+        log=data["log"],
+        output_files=output_files,
+    )
+
+    def save_outputs() -> None:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        for output in data["output"]:
+            basename = posixpath.basename(output["path"])
+            output_files.append(OutputFile(output["type"], basename))
+            save_path = os.path.join(output_dir, basename)
+            if os.path.exists(save_path):
+                logger.warning(
+                    "File already exists at %s. The old file will be overwritten.",
+                    save_path,
+                )
+            with open(save_path, "wb") as file_:
+                file_.write(base64.b64decode(output["contents"]))
+
+    await asyncio.to_thread(save_outputs)
+    return result
+
+
+async def compile_pdf_return_bytes(
+    sources_dir: Path,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    cache: Optional[CompileCache] = None,
+    aux_key: Optional[str] = None,
+    seed_key: Optional[str] = None,
+) -> Tuple[str, BytesIO]:
+    cache = cache or get_default_cache()
+    key, hit = await _cache_lookup(cache, sources_dir, "autotex")
+    if hit is not None:
+        meta, contents = hit
+        return meta["basename"], BytesIO(contents)
+
+    response = await post_sources(
+        sources_dir, host, port, "autotex", response_format="binary", aux_key=aux_key,
+        seed_key=seed_key,
+    )
+    path, contents = parse_primary_output(response.headers, response.content, "pdf")
+    basename = posixpath.basename(path)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, {"basename": basename}, contents)
+    return basename, BytesIO(contents)
+
+
+async def compile_html_return_text(
+    main_tex: str,
+    sources_dir: Path,
+    host: str = "http://127.0.0.1",
+    port: int = 8000,
+    cache: Optional[CompileCache] = None,
+) -> str:
+    cache = cache or get_default_cache()
+    key, hit = await _cache_lookup(cache, sources_dir, "latexml", main_tex)
+    if hit is not None:
+        return hit[1].decode("utf-8")
+
+    response = await post_sources(
+        sources_dir, host, port, "latexml", main_tex, response_format="binary"
+    )
+    path, contents = parse_primary_output(response.headers, response.content, "html")
+    if cache is not None:
+        await asyncio.to_thread(cache.put, key, {"path": path}, contents)
+    return contents.decode("utf-8")
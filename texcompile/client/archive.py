@@ -0,0 +1,135 @@
+import gzip
+import io
+import os
+import queue
+import tarfile
+import threading
+import uuid
+from typing import Dict, Iterable, Iterator, Mapping, Tuple
+
+Path = str
+
+COMPRESSLEVEL = 1
+"""
+gzip level of uploaded archives. 0 sends an uncompressed tar, which is cheapest when the
+service runs on the same host; the previous behaviour corresponds to 9.
+"""
+CHUNK_SIZE = 1 << 16
+_END = object()
+
+
+class _QueueWriter(io.RawIOBase):
+    def __init__(self, chunks: "queue.Queue", stop: threading.Event) -> None:
+        self.chunks = chunks
+        self.stop = stop
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        while True:
+            if self.stop.is_set():
+                raise BrokenPipeError("Archive consumer went away.")
+            try:
+                self.chunks.put(data, timeout=1)
+                return len(data)
+            except queue.Full:
+                continue
+
+
+def iter_archive(sources_dir: Path, compresslevel: int = COMPRESSLEVEL) -> Iterator[bytes]:
+    """
+    Yield a tar (or tar.gz if compresslevel > 0) of `sources_dir` in chunks while it is being
+    built by a background thread, without materializing the archive on disk or in memory.
+    """
+    chunks: "queue.Queue" = queue.Queue(maxsize=16)
+    stop = threading.Event()
+
+    def produce() -> None:
+        try:
+            with io.BufferedWriter(_QueueWriter(chunks, stop), CHUNK_SIZE) as raw:
+                if compresslevel > 0:
+                    with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=compresslevel, mtime=0) as gz:
+                        with tarfile.open(fileobj=gz, mode="w|") as archive:
+                            archive.add(sources_dir, arcname=os.path.sep)
+                else:
+                    with tarfile.open(fileobj=raw, mode="w|") as archive:
+                        archive.add(sources_dir, arcname=os.path.sep)
+        except BrokenPipeError:
+            return
+        except BaseException as e: # pylint: disable=broad-except
+            chunks.put(e)
+        chunks.put(_END)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def multipart_body(
+    fields: Dict[str, str], file_field: str, filename: str, chunks: Iterable[bytes]
+) -> Tuple[Iterator[bytes], str]:
+    """
+    Build a streaming multipart/form-data body. Returns the body iterator, which `requests`
+    sends with chunked transfer encoding, and the matching Content-Type header.
+    """
+    boundary = uuid.uuid4().hex
+
+    def body() -> Iterator[bytes]:
+        for name, value in fields.items():
+            yield (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8")
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode("utf-8")
+        yield from chunks
+        yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+    return body(), f"multipart/form-data; boundary={boundary}"
+
+
+def archive_request(
+    sources_dir: Path, fields: Dict[str, str], compresslevel: int = COMPRESSLEVEL
+) -> Dict:
+    " Keyword arguments for `requests.post` uploading `sources_dir` as the 'sources' field. "
+    filename = "archive.tgz" if compresslevel > 0 else "archive.tar"
+    body, content_type = multipart_body(
+        fields, "sources", filename, iter_archive(sources_dir, compresslevel)
+    )
+    return {"data": body, "headers": {"Content-Type": content_type}}
+
+
+def files_archive(files: Mapping[str, bytes]) -> bytes:
+    " An uncompressed tar of a few files given as relative POSIX paths and contents. "
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for path, contents in files.items():
+            info = tarfile.TarInfo(path)
+            info.size = len(contents)
+            archive.addfile(info, io.BytesIO(contents))
+    return buffer.getvalue()
+
+
+def overlay_request(changes: Mapping[str, bytes], fields: Dict[str, str]) -> Dict:
+    " Keyword arguments for `requests.post` uploading `changes` as the 'overlay' field. "
+    if not changes:
+        return {"files": {name: (None, value) for name, value in fields.items()}}
+    body, content_type = multipart_body(
+        fields, "overlay", "overlay.tar", [files_archive(changes)]
+    )
+    return {"data": body, "headers": {"Content-Type": content_type}}
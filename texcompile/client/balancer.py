@@ -0,0 +1,221 @@
+"""
+Spread compile requests over several service endpoints (containers or nodes):
+
+    balancer = Balancer(["http://10.0.0.1:8000", "http://10.0.0.2:8000"])
+    basename, pdf_bytes = balancer.call(compile_pdf_return_bytes, sources_dir, aux_key=paper)
+
+Each call goes to the least-loaded healthy endpoint and fails over to the next one when the
+endpoint cannot be reached or is busy. Read timeouts and error responses are raised: the
+request may still be running there, or would fail the same way elsewhere.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar, Union
+from urllib.parse import urlsplit
+
+import requests
+
+from . import transport
+from .exceptions import (
+    CircuitOpenException, ConnectionFailedException,
+    ServerConnectionException, ServiceBusyException,
+)
+
+logger = logging.getLogger("texcompile-client")
+
+T = TypeVar("T")
+
+REFRESH_INTERVAL = 5.0
+" Seconds after which the load reported by an endpoint is polled again. "
+RETRY_FAILED_AFTER = 30.0
+" Seconds an endpoint is skipped after a connection error, unless no other is left. "
+FAILOVER_ERRORS = (ConnectionFailedException, CircuitOpenException, ServiceBusyException)
+" Errors of requests that did not run on the endpoint, so they can be sent to another one. "
+
+
+@dataclass
+class Endpoint:
+    host: str
+    port: int
+    workers: int = 1
+    queue_size: int = 0
+    in_flight: int = 0
+    " Requests of this process currently sent to the endpoint. "
+    reported: int = 0
+    " Running and queued compiles reported by the service at the last refresh. "
+    in_flight_at_report: int = 0
+    refreshed: float = 0.0
+    ready: bool = True
+    " Whether the service reported that its warm-up finished. "
+    failed_at: Optional[float] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def url(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def load(self) -> float:
+        """
+        Estimated compiles per worker: the service's report, corrected by the requests this
+        process sent or finished since.
+        """
+        with self.lock:
+            pending = max(self.in_flight, self.reported + self.in_flight - self.in_flight_at_report)
+        return pending / max(self.workers, 1)
+
+    def healthy(self, now: float) -> bool:
+        return self.failed_at is None or now - self.failed_at >= RETRY_FAILED_AFTER
+
+    def refresh(self) -> None:
+        " Poll the service's /status. Services without it count as idle single workers. "
+        try:
+            response = transport.get_session().get(
+                self.url + "/status", timeout=transport.CONNECT_TIMEOUT
+            )
+        except requests.exceptions.RequestException as e:
+            logger.warning("Status of %s failed: %s", self.url, e)
+            self.failed_at = time.monotonic()
+            return
+        with self.lock:
+            self.refreshed = time.monotonic()
+            if response.ok:
+                stats = response.json()
+                self.workers = stats.get("workers", 1)
+                self.queue_size = stats.get("queue_size", 0)
+                self.reported = stats.get("running", 0) + stats.get("queued", 0)
+                self.in_flight_at_report = self.in_flight
+                self.ready = stats.get("ready", True)
+
+    def saturated(self) -> None:
+        " The service rejected a request as busy: count it as full until the next refresh. "
+        with self.lock:
+            self.refreshed = time.monotonic()
+            self.reported = self.workers + self.queue_size
+            self.in_flight_at_report = self.in_flight - 1 # the rejected request is not running
+
+
+def parse_endpoint(endpoint: Union[str, Tuple[str, int]]) -> Endpoint:
+    " 'http://host:port' strings, or (host, port) tuples as passed to the client functions. "
+    if isinstance(endpoint, str):
+        parts = urlsplit(endpoint if "://" in endpoint else "http://" + endpoint)
+        return Endpoint(f"{parts.scheme}://{parts.hostname}", parts.port or 80)
+    host, port = endpoint
+    return Endpoint(host, int(port))
+
+
+class Balancer:
+    """
+    Routes requests to the least-loaded of several service endpoints. The load of an endpoint
+    combines the requests this process has in flight to it with the running and queued
+    compiles the service reports on /status (polled every `refresh_interval` seconds), so
+    requests from other processes and nodes are accounted for as well. Endpoints that fail
+    with a connection error are skipped for a while; busy endpoints are only skipped for the
+    current call, and endpoints still warming up as long as others are ready.
+    """
+
+    def __init__(
+        self,
+        endpoints: Iterable[Union[str, Tuple[str, int]]],
+        refresh_interval: float = REFRESH_INTERVAL,
+    ) -> None:
+        self.endpoints: List[Endpoint] = [parse_endpoint(e) for e in endpoints]
+        if not self.endpoints:
+            raise ValueError("A balancer needs at least one endpoint.")
+        self.refresh_interval = refresh_interval
+
+    def choose(self, exclude: Set[str] = frozenset()) -> Optional[Endpoint]:
+        """
+        The least-loaded healthy endpoint not in `exclude` (a set of URLs), preferring ready
+        ones. If all of them are failing, the one that failed longest ago is tried again.
+        """
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e.url not in exclude]
+        for endpoint in candidates:
+            if endpoint.healthy(now) and now - endpoint.refreshed >= self.refresh_interval:
+                endpoint.refresh()
+        if not candidates:
+            return None
+        healthy = [e for e in candidates if e.healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda e: e.failed_at or 0.0)
+        healthy = [e for e in healthy if e.ready] or healthy
+        random.shuffle(healthy) # break ties between equally loaded endpoints
+        return min(healthy, key=lambda e: e.load)
+
+    @contextmanager
+    def lease(self, exclude: Set[str] = frozenset()) -> Iterator[Endpoint]:
+        """
+        Pin requests to one endpoint, e.g. for a workspace and its compiles. Connection
+        errors inside the block mark the endpoint as failing, but are not retried elsewhere.
+        Other errors of the service leave it healthy.
+        """
+        endpoint = self.choose(exclude)
+        if endpoint is None:
+            raise ServerConnectionException("No endpoint left to try.")
+        with endpoint.lock:
+            endpoint.in_flight += 1
+        try:
+            yield endpoint
+        except ServiceBusyException:
+            endpoint.saturated()
+            raise
+        except (ConnectionFailedException, CircuitOpenException):
+            endpoint.failed_at = time.monotonic()
+            raise
+        else:
+            endpoint.failed_at = None
+        finally:
+            with endpoint.lock:
+                endpoint.in_flight -= 1
+
+    def call(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call a client function (e.g. `compile_pdf_return_bytes`) with the `host` and `port` of
+        the least-loaded endpoint. On `FAILOVER_ERRORS` the call is repeated on the next
+        endpoint; once all were tried, they are tried again after a backoff, for
+        `transport.MAX_ATTEMPTS` rounds. Other errors are raised at once.
+        """
+        error: Optional[Exception] = None
+        for attempt in range(transport.MAX_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(transport.backoff(attempt - 1))
+            tried: Set[str] = set()
+            while len(tried) < len(self.endpoints):
+                try:
+                    with self.lease(tried) as endpoint:
+                        tried.add(endpoint.url)
+                        with transport.single_attempt():
+                            return fn(*args, host=endpoint.host, port=endpoint.port, **kwargs)
+                except FAILOVER_ERRORS as e:
+                    logger.warning("Request to %s failed, failing over: %s", endpoint.url, e)
+                    error = e
+        assert error is not None
+        raise error
+
+
+_default_balancer: Optional[Balancer] = None
+
+
+def set_default_balancer(endpoints: Optional[Iterable[Union[str, Tuple[str, int]]]]) -> None:
+    """
+    Configure (or, with `None`, remove) the balancer returned by `get_default_balancer`.
+    Worker processes pick up the comma-separated TEXCOMPILE_ENDPOINTS environment variable
+    instead.
+    """
+    global _default_balancer
+    endpoints = list(endpoints or [])
+    _default_balancer = Balancer(endpoints) if endpoints else None
+
+
+def get_default_balancer() -> Optional[Balancer]:
+    if _default_balancer is None and os.environ.get("TEXCOMPILE_ENDPOINTS"):
+        set_default_balancer(
+            [e.strip() for e in os.environ["TEXCOMPILE_ENDPOINTS"].split(",") if e.strip()]
+        )
+    return _default_balancer
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("texcompile-client")
+
+Path = str
+
+RESCAN_EVERY = 100
+" Puts after which the cache directory is scanned again, to count entries of other processes. "
+EVICT_TO = 0.9
+" Eviction shrinks the cache to this fraction of `max_bytes`, so a full cache is not rescanned on every put. "
+
+
+def hash_sources(sources_dir: Path) -> str:
+    """
+    Hash a source tree independently of file timestamps, permissions and directory listing
+    order: only relative POSIX paths and file contents go into the digest.
+    """
+    digest = hashlib.sha256()
+    paths = []
+    for dirpath, _, filenames in os.walk(sources_dir):
+        for filename in filenames:
+            full = os.path.join(dirpath, filename)
+            if os.path.isfile(full):
+                paths.append(os.path.relpath(full, sources_dir).replace(os.path.sep, "/"))
+    for path in sorted(paths):
+        digest.update(path.encode("utf-8") + b"\0")
+        with open(os.path.join(sources_dir, path), "rb") as file_:
+            for chunk in iter(lambda: file_.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """
+    On-disk cache of compilation outputs, keyed by the hash of the source tree, the compile
+    mode and the main file. Each entry is a payload file (the PDF or HTML) plus a small JSON
+    file with metadata. Entries are evicted least-recently-used first once the cache grows
+    beyond `max_bytes`. Several processes may share one cache directory.
+    The total size is tracked in memory, so a put only scans the directory when the cache is
+    over its limit, or every RESCAN_EVERY puts to count what other processes added.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = 10 * 1024 ** 3) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total: Optional[int] = None
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, sources_dir: Path, mode: str, main_tex: str = "") -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{mode}\0{main_tex.strip()}\0".encode("utf-8"))
+        digest.update(hash_sources(sources_dir).encode("ascii"))
+        return digest.hexdigest()
+
+    def _paths(self, key: str) -> Tuple[Path, Path]:
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".json", base + ".bin"
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], bytes]]:
+        meta_path, payload_path = self._paths(key)
+        try:
+            with open(meta_path) as file_:
+                meta = json.load(file_)
+            with open(payload_path, "rb") as file_:
+                payload = file_.read()
+            os.utime(payload_path) # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return meta, payload
+
+    def put(self, key: str, meta: Dict[str, Any], payload: bytes) -> None:
+        meta_path, payload_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(payload_path)
+        except OSError:
+            replaced = 0
+        # Write to temporary files first so that concurrent readers never see partial entries.
+        for path, contents in ((payload_path, payload), (meta_path, json.dumps(meta).encode())):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as file_:
+                file_.write(contents)
+            os.replace(tmp_path, path)
+        self._puts += 1
+        if self._total is None or self._puts % RESCAN_EVERY == 0:
+            self.evict() # (re)counts the directory
+        else:
+            self._total += len(payload) - replaced
+            if self._total > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".bin"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, filename)))
+                total += stat.st_size
+        entries.sort()
+        if total > self.max_bytes:
+            while total > self.max_bytes * EVICT_TO and entries:
+                _, size, payload_path = entries.pop(0)
+                for path in (payload_path, payload_path[: -len(".bin")] + ".json"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+                logger.debug("Evicted %s from the compile cache.", payload_path)
+        self._total = total
+
+
+_default_cache: Optional[CompileCache] = None
+
+
+def set_default_cache(directory: Optional[Path], max_bytes: int = 10 * 1024 ** 3) -> None:
+    """
+    Enable (or, with `None`, disable) the cache used when no cache is passed explicitly.
+    Worker processes pick up the TEXCOMPILE_CACHE_DIR environment variable instead.
+    """
+    global _default_cache
+    _default_cache = CompileCache(directory, max_bytes) if directory else None
+
+
+def get_default_cache() -> Optional[CompileCache]:
+    if _default_cache is None and os.environ.get("TEXCOMPILE_CACHE_DIR"):
+        set_default_cache(
+            os.environ["TEXCOMPILE_CACHE_DIR"],
+            int(os.environ.get("TEXCOMPILE_CACHE_MAX_BYTES", 10 * 1024 ** 3)),
+        )
+    return _default_cache
@@ -0,0 +1,26 @@
+class ServerConnectionException(Exception):
+    pass
+
+
+class ConnectionFailedException(ServerConnectionException):
+    """
+    Raised when the service could not be reached at all. Unlike read timeouts and error
+    responses, the request is known not to be running there, so it can go to another container.
+    """
+
+
+class CircuitOpenException(ServerConnectionException):
+    """
+    Raised without contacting the service while its endpoint's circuit breaker is open.
+    """
+
+
+class ServiceBusyException(ServerConnectionException):
+    """
+    Raised when the service rejects a request because all of its compile workers are busy.
+    The service itself is healthy, so the request can go to another container.
+    """
+
+
+class CompilationException(Exception):
+    pass
@@ -0,0 +1,123 @@
+import math
+
+import pytest
+
+from texcompile.client import balancer, transport
+from texcompile.client.balancer import Balancer
+from texcompile.client.exceptions import (
+    ConnectionFailedException, ServerConnectionException, ServiceBusyException,
+)
+
+A = "http://a:8000"
+B = "http://b:8000"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(transport, "backoff", lambda attempt: 0)
+
+
+def make_balancer():
+    # endpoints are never polled, their load is set by the tests
+    return Balancer([A, B], refresh_interval=math.inf)
+
+
+def endpoint(balancer_, url):
+    return next(e for e in balancer_.endpoints if e.url == url)
+
+
+def compile_on(errors):
+    " A client function failing with errors[url] on the given endpoints. "
+    calls = []
+
+    def fn(host, port):
+        url = f"{host}:{port}"
+        calls.append(url)
+        if url in errors:
+            raise errors[url]
+        return url
+
+    return fn, calls
+
+
+def test_fails_over_when_the_endpoint_cannot_be_reached():
+    balancer_ = make_balancer()
+    endpoint(balancer_, B).reported = 1 # A is preferred
+    fn, calls = compile_on({A: ConnectionFailedException("refused")})
+    assert balancer_.call(fn) == B
+    assert calls == [A, B]
+    assert endpoint(balancer_, A).failed_at is not None
+    assert endpoint(balancer_, B).failed_at is None
+
+    # the failed endpoint is skipped by the next calls
+    fn, calls = compile_on({})
+    assert balancer_.call(fn) == B
+
+
+def test_busy_endpoint_is_skipped_for_the_call_only():
+    balancer_ = make_balancer()
+    endpoint(balancer_, B).reported = 1
+    fn, calls = compile_on({A: ServiceBusyException("busy")})
+    assert balancer_.call(fn) == B
+    a = endpoint(balancer_, A)
+    assert a.failed_at is None
+    assert a.load == (a.workers + a.queue_size) / a.workers
+
+
+@pytest.mark.parametrize("error", [
+    ServerConnectionException("Request to server failed.", "read timeout"),
+    ServerConnectionException("Server returned 500."),
+])
+def test_no_failover_on_timeouts_and_error_responses(error):
+    balancer_ = make_balancer()
+    endpoint(balancer_, B).reported = 1
+    fn, calls = compile_on({A: error})
+    with pytest.raises(ServerConnectionException) as raised:
+        balancer_.call(fn)
+    assert raised.value is error
+    assert calls == [A]
+    assert endpoint(balancer_, A).failed_at is None
+
+
+def test_all_endpoints_unreachable():
+    balancer_ = make_balancer()
+    error = ConnectionFailedException("refused")
+    fn, calls = compile_on({A: error, B: error})
+    with pytest.raises(ConnectionFailedException):
+        balancer_.call(fn)
+    assert len(calls) == 2 * transport.MAX_ATTEMPTS
+
+
+def test_choose_least_loaded_ready_endpoint():
+    balancer_ = make_balancer()
+    a, b = endpoint(balancer_, A), endpoint(balancer_, B)
+    a.workers, a.reported = 4, 2 # half loaded
+    b.workers, b.reported = 1, 1 # fully loaded
+    assert balancer_.choose() is a
+    a.in_flight = 3 # requests sent since the report count on top of it
+    assert balancer_.choose() is b
+    a.in_flight = 0
+    a.ready = False # still warming up
+    assert balancer_.choose() is b
+    b.ready = False # nothing is ready, the least loaded is used
+    assert balancer_.choose() is a
+
+
+def test_refresh_reads_status(monkeypatch):
+    class Response:
+        ok = True
+
+        def json(self):
+            return {"status": "ok", "ready": False, "workers": 2, "queue_size": 4,
+                    "running": 2, "queued": 1}
+
+    class Session:
+        def get(self, url, timeout):
+            assert url == A + "/status"
+            return Response()
+
+    monkeypatch.setattr(transport, "get_session", Session)
+    a = balancer.parse_endpoint(A)
+    a.refresh()
+    assert (a.workers, a.queue_size, a.reported, a.ready) == (2, 4, 3, False)
+    assert a.load == 1.5
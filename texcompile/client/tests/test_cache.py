@@ -0,0 +1,38 @@
+import json
+
+import texcompile.client as client
+from texcompile.client import RESULT_HEADER, CompileCache
+
+
+class Response:
+    def __init__(self, path, content):
+        self.headers = {RESULT_HEADER: json.dumps({"path": path})}
+        self.content = content
+
+
+def test_workspace_compiles_share_the_cache(tmp_path, monkeypatch):
+    sources = tmp_path / "sources"
+    sources.mkdir()
+    (sources / "main.tex").write_text("\\documentclass{article}")
+    cache = CompileCache(str(tmp_path / "cache"))
+    posts = []
+
+    def post(url, body):
+        posts.append(url)
+        return Response("main.pdf", b"%PDF")
+
+    monkeypatch.setattr(client, "post", post)
+    for _ in range(2):
+        basename, pdf = client.compile_workspace_pdf(
+            "w", {"main.tex": b"\\documentclass{article}"}, sources_dir=str(sources), cache=cache,
+        )
+        assert (basename, pdf.read()) == ("main.pdf", b"%PDF")
+    assert len(posts) == 1
+
+    # the same tree sent whole is served from the entry of the workspace compile
+    assert client.compile_pdf_return_bytes(str(sources), cache=cache)[0] == "main.pdf"
+    assert len(posts) == 1
+
+    # without the materialized tree there is no key, and the cache is bypassed
+    client.compile_workspace_pdf("w", {}, cache=cache)
+    assert len(posts) == 2
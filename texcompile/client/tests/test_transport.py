@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+import requests
+
+from texcompile.client import aio, transport
+from texcompile.client.exceptions import (
+    CircuitOpenException, ConnectionFailedException, ServerConnectionException,
+    ServiceBusyException,
+)
+
+ENDPOINT = "http://service:8000/"
+BUSY = (503, json.dumps({"status": "busy"}).encode())
+
+
+@pytest.fixture(autouse=True)
+def fresh_policy(monkeypatch):
+    monkeypatch.setattr(transport, "backoff", lambda attempt: 0)
+    monkeypatch.setattr(transport, "_breakers", {})
+
+
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+
+
+def blocking_post(monkeypatch, outcomes):
+    " Send a request with `transport.post`, the session answering with `outcomes` in turn. "
+    outcomes = iter(outcomes)
+
+    class Session:
+        def request(self, method, url, timeout, **kwargs):
+            outcome = next(outcomes)
+            if outcome is None:
+                raise requests.exceptions.ConnectionError("refused")
+            return Response(*outcome)
+
+    monkeypatch.setattr(transport, "get_session", Session)
+    return transport.post(ENDPOINT, dict).status_code
+
+
+def async_post(monkeypatch, outcomes):
+    " The same with `aio.post`. "
+    outcomes = iter(outcomes)
+
+    class Client:
+        async def post(self, url, **kwargs):
+            outcome = next(outcomes)
+            if outcome is None:
+                raise httpx.ConnectError("refused")
+            return Response(*outcome)
+
+    monkeypatch.setattr(aio, "get_client", Client)
+    return asyncio.run(aio.post(ENDPOINT, dict)).status_code
+
+
+@pytest.fixture(params=[blocking_post, async_post])
+def post(request, monkeypatch):
+    return lambda outcomes: request.param(monkeypatch, outcomes)
+
+
+def test_retries_connection_errors_and_gateway_responses(post):
+    assert post([None, (502, b""), BUSY, (200, b"ok")]) == 200
+
+
+def test_error_responses_are_not_retried(post):
+    with pytest.raises(ServerConnectionException) as raised:
+        post([(500, b"error"), (200, b"ok")])
+    assert type(raised.value) is ServerConnectionException
+
+
+@pytest.mark.parametrize("outcome, error", [
+    (None, ConnectionFailedException),
+    (BUSY, ServiceBusyException),
+])
+def test_exhausted_attempts(post, outcome, error):
+    with pytest.raises(error):
+        post([outcome] * transport.MAX_ATTEMPTS)
+
+
+def test_circuit_opens_after_repeated_failures(post):
+    with pytest.raises(ConnectionFailedException):
+        post([None] * transport.MAX_ATTEMPTS)
+    with pytest.raises(CircuitOpenException):
+        post([(200, b"ok")])
@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .exceptions import (
+    CircuitOpenException, ConnectionFailedException,
+    ServerConnectionException, ServiceBusyException,
+)
+
+logger = logging.getLogger("texcompile-client")
+
+CONNECT_TIMEOUT = 10
+" Seconds to wait for a connection to the service. "
+READ_TIMEOUT = 60 * 60
+" Seconds to wait for a response. LaTeXML runs alone may take up to 40 minutes. "
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_STATUS_CODES = {502, 503, 504}
+POOL_MAXSIZE = 32
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker. After `failure_threshold` consecutive failures the circuit
+    opens and requests fail immediately for `reset_timeout` seconds. Then a single trial
+    request is let through; it closes the circuit on success and re-opens it on failure.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened_at is not None and (
+                self._trial or time.monotonic() - self.opened_at < self.reset_timeout
+            )
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True # half-open: let one request through
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_local = threading.local()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+        return _breakers[endpoint]
+
+
+def get_session() -> requests.Session:
+    """
+    Module-level session with a keep-alive connection pool, recreated after a fork.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=POOL_MAXSIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session, _session_pid = session, os.getpid()
+    return _session
+
+
+@contextmanager
+def single_attempt() -> Iterator[None]:
+    """
+    Within the block, requests of this thread raise on the first connection error or busy
+    response instead of retrying, so that the caller (see `balancer.Balancer`) can retry on
+    another endpoint.
+    """
+    previous = getattr(_local, "single_attempt", False)
+    _local.single_attempt = True
+    try:
+        yield
+    finally:
+        _local.single_attempt = previous
+
+
+def backoff(attempt: int) -> float:
+    " Full-jitter exponential backoff. "
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def is_busy(status_code: int, body: bytes) -> bool:
+    " Whether a response is the service's explicit 'all workers busy' rejection. "
+    if status_code != 503:
+        return False
+    try:
+        return json.loads(body).get("status") == "busy"
+    except (ValueError, AttributeError):
+        return False
+
+
+class RetryPolicy:
+    """
+    The retry, backoff and circuit-breaker policy of one request, without the I/O, so that the
+    blocking `request` and `aio.post` only differ in how they send and sleep:
+
+        policy = RetryPolicy(endpoint)
+        for delay in policy.delays():
+            time.sleep(delay)
+            policy.check_circuit()
+            try:
+                response = send()
+            except ConnectError as e:
+                policy.connection_failed(e)
+                continue
+            except OtherError as e:
+                raise policy.request_failed(e)
+            if policy.done(response.status_code, response.content, response.text):
+                return response
+        raise policy.exhausted()
+
+    Connection errors and gateway/busy responses are retried with jittered exponential backoff;
+    read timeouts are not, as the service is most likely still working on the request.
+    A busy service does not count as a failure for the circuit breaker. With `retry_busy=False`
+    busy responses raise `ServiceBusyException` at once, for callers that can go elsewhere.
+    A final connection error raises `ConnectionFailedException`.
+    """
+
+    def __init__(self, endpoint: str, retry_busy: bool = True) -> None:
+        self.endpoint = endpoint
+        self.breaker = get_breaker(endpoint)
+        self.attempts = MAX_ATTEMPTS
+        self.retry_busy = retry_busy
+        if getattr(_local, "single_attempt", False):
+            self.attempts, self.retry_busy = 1, False
+        self.attempt = 0
+        self.error: Optional[Exception] = None
+        self.connection_error = False
+
+    def delays(self) -> Iterator[float]:
+        " The seconds to wait before each attempt. "
+        for attempt in range(self.attempts):
+            self.attempt = attempt
+            yield backoff(attempt - 1) if attempt > 0 else 0.0
+
+    def check_circuit(self) -> None:
+        if not self.breaker.allow():
+            raise CircuitOpenException(f"Circuit for {self.endpoint} is open.", self.error)
+
+    def connection_failed(self, error: Exception) -> None:
+        self.breaker.record_failure()
+        self.error, self.connection_error = error, True
+        logger.warning(
+            "Request to %s failed (attempt %d): %s", self.endpoint, self.attempt + 1, error
+        )
+
+    def request_failed(self, error: Exception) -> ServerConnectionException:
+        self.breaker.record_failure()
+        return ServerConnectionException(f"Request to server {self.endpoint} failed.", error)
+
+    def done(self, status_code: int, body: bytes, text: str) -> bool:
+        """
+        Whether the response is final. Returns False for responses to retry and raises for
+        error responses.
+        """
+        self.connection_error = False
+        if is_busy(status_code, body):
+            self.breaker.record_success()
+            self.error = ServiceBusyException(f"Server {self.endpoint} is busy.", text[:1000])
+            if not self.retry_busy:
+                raise self.error
+            return False
+        if status_code in RETRY_STATUS_CODES:
+            self.breaker.record_failure()
+            self.error = ServerConnectionException(f"Server {self.endpoint} returned {status_code}.")
+            return False
+        self.breaker.record_success()
+        if status_code >= 400:
+            raise ServerConnectionException(
+                f"Server {self.endpoint} returned {status_code}.", text[:1000]
+            )
+        return True
+
+    def exhausted(self) -> Exception:
+        " The error to raise once all attempts failed. "
+        if isinstance(self.error, ServiceBusyException):
+            return self.error
+        if self.connection_error:
+            return ConnectionFailedException(
+                f"Could not connect to server {self.endpoint} in {self.attempts} attempts.",
+                self.error,
+            )
+        return ServerConnectionException(
+            f"Request to server {self.endpoint} failed after {self.attempts} attempts.", self.error
+        )
+
+
+def post(
+    endpoint: str, make_request: Callable[[], Dict[str, Any]], retry_busy: bool = True
+) -> requests.Response:
+    return request("POST", endpoint, make_request, retry_busy)
+
+
+def request(
+    method: str,
+    endpoint: str,
+    make_request: Callable[[], Dict[str, Any]] = dict,
+    retry_busy: bool = True,
+) -> requests.Response:
+    """
+    Send a request to the service with bounded retries (see `RetryPolicy`). `make_request`
+    returns the keyword arguments for `requests.request` and is called again for each attempt,
+    so that upload bodies can be rebuilt.
+    """
+    policy = RetryPolicy(endpoint, retry_busy)
+    for delay in policy.delays():
+        time.sleep(delay)
+        policy.check_circuit()
+        try:
+            response = get_session().request(
+                method, endpoint, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **make_request()
+            )
+        except requests.exceptions.ConnectionError as e:
+            policy.connection_failed(e)
+            continue
+        except requests.exceptions.RequestException as e:
+            raise policy.request_failed(e)
+        if policy.done(response.status_code, response.content, response.text):
+            return response
+    raise policy.exhausted()
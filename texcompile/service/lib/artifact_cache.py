@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+Path = str
+
+
+def hash_tree(sources_dir: Path) -> str:
+    """
+    Hash an unpacked source tree. Only relative POSIX paths and file contents go into the
+    digest, so identical sources hash the same however the archive was packed.
+    """
+    digest = hashlib.sha256()
+    paths = []
+    for dirpath, _, filenames in os.walk(sources_dir):
+        for filename in filenames:
+            full = os.path.join(dirpath, filename)
+            if os.path.isfile(full):
+                paths.append(os.path.relpath(full, sources_dir).replace(os.path.sep, "/"))
+    for path in sorted(paths):
+        digest.update(path.encode("utf-8") + b"\0")
+        with open(os.path.join(sources_dir, path), "rb") as file_:
+            for chunk in iter(lambda: file_.read(1 << 20), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Size-bounded LRU cache of compile results (outputs and log), keyed by the hash of the
+    unpacked sources, the compiler and the main file. Each entry is a directory holding the
+    result as JSON and one file per output. Results are stored with raw (not base64-encoded)
+    contents.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, sources_dir: Path, autotex_or_latexml: str, main_tex_file: str = "") -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{autotex_or_latexml}\0{main_tex_file.strip()}\0".encode("utf-8"))
+        digest.update(hash_tree(sources_dir).encode("ascii"))
+        return digest.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "result.json")) as file_:
+                json_result = json.load(file_)
+            for i, output in enumerate(json_result["output"]):
+                with open(os.path.join(entry, str(i)), "rb") as file_:
+                    output["contents"] = file_.read()
+            os.utime(entry) # mark as recently used
+        except (OSError, ValueError):
+            return None
+        return json_result
+
+    def put(self, key: str, json_result: Dict[str, Any]) -> None:
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        # Fill a temporary directory and rename it, so that readers never see partial entries.
+        tmp_entry = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            meta = dict(json_result)
+            meta["output"] = []
+            for i, output in enumerate(json_result["output"]):
+                with open(os.path.join(tmp_entry, str(i)), "wb") as file_:
+                    file_.write(output["contents"])
+                meta["output"].append({k: v for k, v in output.items() if k != "contents"})
+            with open(os.path.join(tmp_entry, "result.json"), "w") as file_:
+                json.dump(meta, file_)
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # e.g. a concurrent compile of the same sources stored its entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                entry = os.path.join(self.directory, name)
+                if name.startswith(".tmp-"):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry))
+                    mtime = os.stat(entry).st_mtime
+                except OSError:
+                    continue
+                entries.append((mtime, size, entry))
+                total += size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, entry = entries.pop(0)
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                logging.debug("Evicted %s from the artifact cache.", entry)
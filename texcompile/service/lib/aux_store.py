@@ -0,0 +1,103 @@
+import glob
+import hashlib
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+from typing import List
+
+Path = str
+
+# Contents files (.toc, .lof, .lot, .out) are left out: LaTeX typesets them as read, so a
+# stale one would stay in the output of a compile that settles in a single pass.
+AUX_EXTENSIONS = (".aux", ".bbl")
+" Files LaTeX reads back on the next pass to resolve references and citations. "
+
+
+class AuxStore:
+    """
+    Auxiliary files of previous compiles, stored under a client-chosen key (e.g. the paper id
+    and the variant compiled, so that concurrent variants do not replace each other's). Later
+    compiles of the paper are seeded from one of the keys (e.g. its plain variant's), so that
+    references and citations resolve on the first LaTeX pass and AutoTeX does not need extra
+    passes to settle them.
+    Files included in an upload always take precedence over stored ones. Keys used least
+    recently are evicted once the store grows beyond 'max_bytes'.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry(self, aux_key: str) -> Path:
+        return os.path.join(self.directory, hashlib.sha256(aux_key.encode("utf-8")).hexdigest())
+
+    def seed(self, aux_key: str, sources_dir: Path) -> List[str]:
+        """
+        Copy stored files that are missing from 'sources_dir' into it. Returns their paths.
+        """
+        entry = self._entry(aux_key)
+        seeded = []
+        for path in glob.glob(os.path.join(entry, "**", "*"), recursive=True):
+            if not os.path.isfile(path):
+                continue
+            relpath = os.path.relpath(path, entry)
+            dest = os.path.join(sources_dir, relpath)
+            if os.path.exists(dest):
+                continue
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(path, dest)
+            seeded.append(relpath)
+        if seeded:
+            os.utime(entry) # mark as recently used
+        return seeded
+
+    def store(self, aux_key: str, sources_dir: Path) -> None:
+        """
+        Keep the auxiliary files of a finished compile, replacing those stored before.
+        """
+        tmp_entry = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        for path in glob.glob(os.path.join(sources_dir, "**", "*"), recursive=True):
+            if path.endswith(AUX_EXTENSIONS) and os.path.isfile(path):
+                dest = os.path.join(tmp_entry, os.path.relpath(path, sources_dir))
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copyfile(path, dest)
+        entry = self._entry(aux_key)
+        with self._lock:
+            # swap whole directories, so that seeds never mix old and new files
+            old_entry = None
+            if os.path.exists(entry):
+                old_entry = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+                os.rename(entry, os.path.join(old_entry, "entry"))
+            os.rename(tmp_entry, entry)
+        if old_entry is not None:
+            shutil.rmtree(old_entry, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                entry = os.path.join(self.directory, name)
+                if name.startswith(".tmp-"):
+                    continue
+                size = 0
+                for dirpath, _, filenames in os.walk(entry):
+                    for filename in filenames:
+                        try:
+                            size += os.path.getsize(os.path.join(dirpath, filename))
+                        except OSError:
+                            pass
+                entries.append((os.path.getmtime(entry), size, entry))
+                total += size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, entry = entries.pop(0)
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                logging.debug("Evicted %s from the aux store.", entry)
@@ -59,7 +59,12 @@ def compile_autotex(
     texlive_path: Path,
     system_path: Path,
     perl_binary: Path,
+    encode_contents: bool = True,
 ) -> Dict[str, Any]:
+    """
+    Compile the sources and describe the result as a JSON-serializable dict. Output file
+    contents are base64-encoded, or left as raw bytes if 'encode_contents' is False.
+    """
     if os.path.exists('/tmpfs'):
         tmp_path = '/tmpfs/'
     else:
@@ -67,40 +72,55 @@ def compile_autotex(
     with tempfile.TemporaryDirectory(dir=tmp_path) as temp_directory:
         sources_dir = os.path.join(temp_directory, "sources")
         unpack_archive(compressed_sources_file, sources_dir)
-        before_compile_pdfs = set(glob.glob(sources_dir+"/*.pdf"))
-        compilation_result = run_compilation(
-            sources_dir, texlive_path, system_path, perl_binary
+        return compile_autotex_dir(
+            sources_dir, texlive_path, system_path, perl_binary, encode_contents=encode_contents
         )
 
-        json_result: Dict[str, Any] = {}
-        json_result["success"] = compilation_result.success
-        if json_result["success"] is True:
-            json_result["has_output"] = True
-            file_diff = {}
-        else:
-            after_compile_pdfs = set(glob.glob(sources_dir+"/*.pdf"))
-            file_diff = after_compile_pdfs - before_compile_pdfs
-            json_result["has_output"] = len(file_diff)!=0
-        json_result["log"] = compilation_result.stdout.decode(
-            "utf-8", errors="backslashreplace"
-        )
-        json_result["main_tex_files"] = [
-            f.path for f in compilation_result.compiled_tex_files
-        ]
-        json_result["output"] = []
-        for output_file in compilation_result.output_files + list(file_diff):
-            if not isinstance(output_file, OutputFile):
-                assert isinstance(output_file, str)
-                output_file = OutputFile("pdf", output_file)
-            with open(os.path.join(sources_dir, output_file.path), mode="rb") as file_:
-                contents = file_.read()
-
-            output = {
-                "type": output_file.output_type,
-                "path": output_file.path,
-                "contents": base64.b64encode(contents).decode(),
-            }
-            json_result["output"].append(output)
+
+def compile_autotex_dir(
+    sources_dir: Path,
+    texlive_path: Path,
+    system_path: Path,
+    perl_binary: Path,
+    encode_contents: bool = True,
+) -> Dict[str, Any]:
+    """
+    Compile sources that are already unpacked into 'sources_dir', see 'compile_autotex'.
+    """
+    before_compile_pdfs = set(glob.glob(sources_dir+"/*.pdf"))
+    compilation_result = run_compilation(
+        sources_dir, texlive_path, system_path, perl_binary
+    )
+
+    json_result: Dict[str, Any] = {}
+    json_result["success"] = compilation_result.success
+    if json_result["success"] is True:
+        json_result["has_output"] = True
+        file_diff = {}
+    else:
+        after_compile_pdfs = set(glob.glob(sources_dir+"/*.pdf"))
+        file_diff = after_compile_pdfs - before_compile_pdfs
+        json_result["has_output"] = len(file_diff)!=0
+    json_result["log"] = compilation_result.stdout.decode(
+        "utf-8", errors="backslashreplace"
+    )
+    json_result["main_tex_files"] = [
+        f.path for f in compilation_result.compiled_tex_files
+    ]
+    json_result["output"] = []
+    for output_file in compilation_result.output_files + list(file_diff):
+        if not isinstance(output_file, OutputFile):
+            assert isinstance(output_file, str)
+            output_file = OutputFile("pdf", output_file)
+        with open(os.path.join(sources_dir, output_file.path), mode="rb") as file_:
+            contents = file_.read()
+
+        output = {
+            "type": output_file.output_type,
+            "path": output_file.path,
+            "contents": base64.b64encode(contents).decode() if encode_contents else contents,
+        }
+        json_result["output"].append(output)
 
     return json_result
 
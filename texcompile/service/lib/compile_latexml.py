@@ -11,6 +11,7 @@ from dataclasses import dataclass
 from typing import Any, Dict, Iterator, List, Optional
 import glob
 
+from lib.latexml_daemon import LatexmlDaemon
 from lib.unpack_tex import unpack_archive
 
 Path = str
@@ -50,8 +51,15 @@ class CompilationResult:
 
 def compile_latexml(
     compressed_sources_file: str,
-    main_tex_file: str
+    main_tex_file: str,
+    encode_contents: bool = True,
+    daemon: Optional[LatexmlDaemon] = None,
 ) -> Dict[str, Any]:
+    """
+    Compile the sources with LaTeXML. Output file contents are base64-encoded, or left as raw
+    bytes if 'encode_contents' is False. With a 'daemon', the conversion runs on that warm
+    LaTeXML server instead of a freshly started one.
+    """
     if os.path.exists('/tmpfs'):
         tmp_path = '/tmpfs/'
     else:
@@ -59,47 +67,62 @@ def compile_latexml(
     with tempfile.TemporaryDirectory(dir=tmp_path) as temp_directory:
         sources_dir = os.path.join(temp_directory, "sources")
         unpack_archive(compressed_sources_file, sources_dir)
-        before_compile_htmls = set(glob.glob(sources_dir+"/*.html"))
-        compilation_result = run_compilation(
-            sources_dir, main_tex_file
+        return compile_latexml_dir(
+            sources_dir, main_tex_file, encode_contents=encode_contents, daemon=daemon
         )
 
-        json_result: Dict[str, Any] = {}
-        json_result["success"] = compilation_result.success
-        if json_result["success"] is True:
-            json_result["has_output"] = True
-            file_diff = {}
-        else:
-            after_compile_htmls = set(glob.glob(sources_dir+"/*.html"))
-            file_diff = after_compile_htmls - before_compile_htmls
-            json_result["has_output"] = len(file_diff)!=0
-        json_result["log"] = compilation_result.stdout.decode(
-            "utf-8", errors="backslashreplace"
-        )
-        json_result["main_tex_files"] = [
-            f.path for f in compilation_result.compiled_tex_files
-        ]
-        json_result["output"] = []
-        for output_file in compilation_result.output_files + list(file_diff):
-            if not isinstance(output_file, OutputFile):
-                assert isinstance(output_file, str)
-                output_file = OutputFile("html", output_file)
-            with open(os.path.join(sources_dir, output_file.path), mode="rb") as file_:
-                contents = file_.read()
-
-            output = {
-                "type": output_file.output_type,
-                "path": output_file.path,
-                "contents": base64.b64encode(contents).decode(),
-            }
-            json_result["output"].append(output)
+
+def compile_latexml_dir(
+    sources_dir: Path,
+    main_tex_file: str,
+    encode_contents: bool = True,
+    daemon: Optional[LatexmlDaemon] = None,
+) -> Dict[str, Any]:
+    """
+    Compile sources that are already unpacked into 'sources_dir', see 'compile_latexml'.
+    """
+    before_compile_htmls = set(glob.glob(sources_dir+"/*.html"))
+    compilation_result = run_compilation(
+        sources_dir, main_tex_file, daemon
+    )
+
+    json_result: Dict[str, Any] = {}
+    json_result["success"] = compilation_result.success
+    if json_result["success"] is True:
+        json_result["has_output"] = True
+        file_diff = {}
+    else:
+        after_compile_htmls = set(glob.glob(sources_dir+"/*.html"))
+        file_diff = after_compile_htmls - before_compile_htmls
+        json_result["has_output"] = len(file_diff)!=0
+    json_result["log"] = compilation_result.stdout.decode(
+        "utf-8", errors="backslashreplace"
+    )
+    json_result["main_tex_files"] = [
+        f.path for f in compilation_result.compiled_tex_files
+    ]
+    json_result["output"] = []
+    for output_file in compilation_result.output_files + list(file_diff):
+        if not isinstance(output_file, OutputFile):
+            assert isinstance(output_file, str)
+            output_file = OutputFile("html", output_file)
+        with open(os.path.join(sources_dir, output_file.path), mode="rb") as file_:
+            contents = file_.read()
+
+        output = {
+            "type": output_file.output_type,
+            "path": output_file.path,
+            "contents": base64.b64encode(contents).decode() if encode_contents else contents,
+        }
+        json_result["output"].append(output)
 
     return json_result
 
 
 def run_compilation(
     source_path: str, 
-    main_file: str
+    main_file: str,
+    daemon: Optional[LatexmlDaemon] = None,
 ) -> CompilationResult:
     """
     Compile TeX sources into HTML files. Requires running an external
@@ -112,8 +135,10 @@ def run_compilation(
 
     _set_sources_dir_permissions(source_path)
 
+    # A warm server has its preloaded bindings loaded already, a cold run loads them first.
+    server_options = daemon.client_options() if daemon is not None else []
     result = subprocess.run(
-        ["latexmlc", main_path, "--post", "--dest="+main_path+".html", "--timeout=2400"], # expl3 needs 10+min to load https://github.com/brucemiller/LaTeXML/issues/2268
+        ["latexmlc"] + server_options + [main_path, "--post", "--dest="+main_path+".html", "--timeout=2400"], # expl3 needs 10+min to load https://github.com/brucemiller/LaTeXML/issues/2268
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         check=False,
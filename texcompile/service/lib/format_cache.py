@@ -0,0 +1,176 @@
+import glob
+import hashlib
+import logging
+import os
+import os.path
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from typing import List, Optional
+
+Path = str
+
+STYLE_EXTENSIONS = (".sty", ".cls", ".clo", ".def", ".cfg", ".fd")
+" Local files a preamble may load, whose contents go into the format. "
+DUMP_TIMEOUT = 300
+
+BEGIN_DOCUMENT = re.compile(rb"^[^%\n]*\\begin\s*\{document\}", re.MULTILINE)
+DOCUMENTCLASS = re.compile(rb"^[^%\n]*\\documentclass", re.MULTILINE)
+INPUT = re.compile(rb"\\(?:input|include)\s*\{([^}]+)\}")
+
+
+def find_main_file(sources_dir: Path) -> Optional[str]:
+    """
+    The only top-level .tex file with both '\\documentclass' and '\\begin{document}', if any.
+    """
+    candidates = []
+    for path in glob.glob(os.path.join(sources_dir, "*.tex")):
+        with open(path, "rb") as file_:
+            contents = file_.read()
+        if DOCUMENTCLASS.search(contents) and BEGIN_DOCUMENT.search(contents):
+            candidates.append(os.path.basename(path))
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def get_preamble(contents: bytes) -> Optional[bytes]:
+    match = BEGIN_DOCUMENT.search(contents)
+    return contents[: match.start()] if match else None
+
+
+class FormatCache:
+    """
+    Precompiled LaTeX formats of paper preambles, mylatexformat-style. A format is dumped from
+    everything before '\\begin{document}' of the main file, and is keyed by the hash of the
+    preamble, the local style files and the files the preamble inputs. The main file then
+    gets a '%&<format>' first line, which makes pdflatex load the dumped format and skip the
+    preamble instead of reading all package sources again. A format is reused by the LaTeX
+    runs of one AutoTeX compile, by compiles that are retried or run again, and by papers with
+    an identical preamble. The plain, colored and black passes of a paper usually get formats
+    of their own: the annotation loads xcolor and tcolorbox and rewrites the preamble's text,
+    and both end up in the dumped format, so the key cannot ignore them.
+
+    Dumped formats are kept in 'directory', least recently used ones are evicted beyond
+    'max_bytes'.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, texlive_path: Path) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.texlive_path = texlive_path
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, sources_dir: Path, main_file: str) -> Optional[str]:
+        with open(os.path.join(sources_dir, main_file), "rb") as file_:
+            preamble = get_preamble(file_.read())
+        if preamble is None:
+            return None
+        digest = hashlib.sha256()
+        digest.update(self.texlive_path.encode("utf-8") + b"\0" + preamble + b"\0")
+        dependencies: List[str] = sorted(
+            os.path.relpath(path, sources_dir)
+            for path in glob.glob(os.path.join(sources_dir, "**", "*"), recursive=True)
+            if path.endswith(STYLE_EXTENSIONS) and os.path.isfile(path)
+        )
+        for name in INPUT.findall(preamble):
+            name = name.decode("utf-8", errors="replace").strip()
+            for candidate in (name, name + ".tex"):
+                if os.path.isfile(os.path.join(sources_dir, candidate)):
+                    dependencies.append(candidate)
+                    break
+        for name in dependencies:
+            digest.update(name.encode("utf-8") + b"\0")
+            with open(os.path.join(sources_dir, name), "rb") as file_:
+                digest.update(file_.read())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, name: str) -> Path:
+        return os.path.join(self.directory, name + ".fmt")
+
+    def dump(self, sources_dir: Path, main_file: str, name: str, system_path: Path) -> bool:
+        """
+        Dump the format of the main file's preamble into the cache.
+        """
+        with tempfile.TemporaryDirectory(dir=self.directory) as dump_dir:
+            result = subprocess.run(
+                [
+                    "pdftex", "-ini", "-interaction=batchmode", f"-jobname={name}",
+                    f"-output-directory={dump_dir}", "&pdflatex", "mylatexformat.ltx", main_file,
+                ],
+                cwd=sources_dir,
+                env={**os.environ, "PATH": system_path},
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=DUMP_TIMEOUT,
+                check=False,
+            )
+            fmt = os.path.join(dump_dir, name + ".fmt")
+            if result.returncode != 0 or not os.path.exists(fmt):
+                return False
+            os.replace(fmt, self._path(name))
+        self.evict()
+        return True
+
+    def apply(self, sources_dir: Path, system_path: Path) -> Optional[str]:
+        """
+        Make the main file in 'sources_dir' load a precompiled format of its preamble, dumping
+        it first if needed. Returns the format name, or None if the sources were left as they
+        are (no unambiguous main file, PostScript figures that make AutoTeX use latex instead
+        of pdflatex, or a failed dump).
+        """
+        if glob.glob(os.path.join(sources_dir, "**", "*.eps"), recursive=True) or glob.glob(
+            os.path.join(sources_dir, "**", "*.ps"), recursive=True
+        ):
+            return None
+        main_file = find_main_file(sources_dir)
+        if main_file is None:
+            return None
+        key = self.key(sources_dir, main_file)
+        if key is None:
+            return None
+        name = "texcompile-" + key[:24]
+        try:
+            if not os.path.exists(self._path(name)) and not self.dump(
+                sources_dir, main_file, name, system_path
+            ):
+                logging.info("Could not dump a format for %s.", main_file)
+                return None
+            fmt = os.path.join(sources_dir, name + ".fmt")
+            try:
+                os.link(self._path(name), fmt)
+            except OSError: # e.g. on another file system
+                shutil.copyfile(self._path(name), fmt)
+            os.utime(self._path(name)) # mark as recently used
+        except (OSError, subprocess.TimeoutExpired):
+            logging.exception("Could not use a format for %s.", main_file)
+            return None
+
+        main_path = os.path.join(sources_dir, main_file)
+        with open(main_path, "rb") as file_:
+            contents = file_.read()
+        with open(main_path, "wb") as file_:
+            file_.write(b"%&" + name.encode("ascii") + b"\n" + contents)
+        return name
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            total = 0
+            for path in glob.glob(os.path.join(self.directory, "*.fmt")):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
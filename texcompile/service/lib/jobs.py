@@ -0,0 +1,129 @@
+import os
+import os.path
+import shutil
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+Path = str
+
+
+@dataclass
+class Job:
+    id: str
+    autotex_or_latexml: str
+    main_tex_file: str
+    directory: Path
+    " Holds the uploaded sources until the compile starts. "
+    state: str = "queued"
+    " One of 'queued', 'running', 'done' (the compiler ran, see 'result') or 'failed'. "
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    " Result of the compile function, with output contents as bytes. "
+    aux_key: str = ""
+    seed_key: str = ""
+
+    @property
+    def sources_filename(self) -> Path:
+        return os.path.join(self.directory, "sources")
+
+    def status(self, log_lines: int = 50) -> Dict[str, Any]:
+        status = {
+            "id": self.id,
+            "state": self.state,
+            "autotex_or_latexml": self.autotex_or_latexml,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+        if self.result is not None:
+            status["success"] = self.result["success"]
+            status["has_output"] = self.result["has_output"]
+            status["main_tex_files"] = self.result["main_tex_files"]
+            status["cache"] = self.result.get("cache")
+            status["outputs"] = [
+                {"type": o["type"], "path": o["path"]} for o in self.result["output"]
+            ]
+            status["log_tail"] = "\n".join(self.result["log"].splitlines()[-log_lines:])
+        return status
+
+
+class JobStore:
+    """
+    Jobs of the asynchronous compile API. Uploads wait in a directory per job until a worker
+    runs the compile; results are kept in memory until they are deleted or, once finished,
+    older than `keep_seconds`.
+    """
+
+    def __init__(self, directory: Path, keep_seconds: float = 3600) -> None:
+        self.directory = directory
+        self.keep_seconds = keep_seconds
+        self.jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def create(
+        self, autotex_or_latexml: str, main_tex_file: str, aux_key: str = "", seed_key: str = "",
+    ) -> Job:
+        self.prune()
+        job_id = uuid.uuid4().hex
+        job = Job(
+            job_id, autotex_or_latexml, main_tex_file, os.path.join(self.directory, job_id),
+            aux_key=aux_key, seed_key=seed_key,
+        )
+        os.makedirs(job.directory)
+        with self._lock:
+            self.jobs[job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def delete(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            job = self.jobs.pop(job_id, None)
+        if job is not None:
+            shutil.rmtree(job.directory, ignore_errors=True)
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for job in self.jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+    def prune(self) -> List[str]:
+        cutoff = time.time() - self.keep_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self.jobs.items()
+                if job.finished is not None and job.finished < cutoff
+            ]
+        for job_id in expired:
+            self.delete(job_id)
+        return expired
+
+    def run(self, job: Job, compile_fn: Callable[[Job], Dict[str, Any]]) -> None:
+        """
+        Run the compile of a job; called on a worker thread.
+        """
+        job.state = "running"
+        job.started = time.time()
+        try:
+            job.result = compile_fn(job)
+            job.state = "done"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.state = "failed"
+        finally:
+            job.finished = time.time()
+            # the sources are not needed anymore, the result is kept in memory
+            shutil.rmtree(job.directory, ignore_errors=True)
@@ -0,0 +1,163 @@
+import logging
+import queue
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as file_:
+            for line in file_:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class LatexmlDaemon:
+    """
+    One warm 'latexmls' server (from LaTeXML::Plugin::latexmls) listening on a local port.
+    The server loads Perl, LaTeXML and the preloaded bindings once; 'latexmlc --port=...'
+    then hands it conversions. It exits after 'autoflush' conversions and is restarted in the
+    background after the next lease, as well as when its memory grows beyond 'max_rss' bytes.
+    """
+
+    def __init__(
+        self, port: int, preloads: List[str], autoflush: int, max_rss: int,
+        startup_timeout: float = 120,
+    ) -> None:
+        self.port = port
+        self.preloads = preloads
+        self.autoflush = autoflush
+        self.max_rss = max_rss
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+
+    def command(self) -> List[str]:
+        return [
+            "latexmls",
+            f"--port={self.port}",
+            "--address=127.0.0.1",
+            "--expire=-1", # never shut down when idle, we manage the lifetime
+            f"--autoflush={self.autoflush}",
+        ] + [f"--preload={preload}" for preload in self.preloads]
+
+    def client_options(self) -> List[str]:
+        " Options for 'latexmlc' to convert on this server. "
+        return [f"--port={self.port}", "--address=127.0.0.1", "--expire=-1"]
+
+    def _listening(self) -> bool:
+        try:
+            with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def start(self) -> bool:
+        self.stop()
+        logging.info("Starting latexmls on port %d.", self.port)
+        try:
+            self.process = subprocess.Popen(
+                self.command(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            logging.exception("Could not start latexmls.")
+            self.process = None
+            return False
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            if self._listening():
+                return True
+            time.sleep(0.2)
+        logging.warning("latexmls on port %d did not come up.", self.port)
+        self.stop()
+        return False
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def healthy(self) -> bool:
+        process = self.process # may be replaced by a start in the background
+        if process is None or process.poll() is not None:
+            return False
+        if self.max_rss and _rss_bytes(process.pid) > self.max_rss:
+            logging.info("Restarting latexmls on port %d, its memory grew too large.", self.port)
+            return False
+        return self._listening()
+
+    def ensure_running(self) -> bool:
+        with self._lock:
+            return self.healthy() or self.start()
+
+    def ensure_running_in_background(self) -> threading.Thread:
+        " Start the server in a thread, unless a start is already under way. "
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.ensure_running, daemon=True)
+                self._thread.start()
+            return self._thread
+
+
+class LatexmlDaemonPool:
+    """
+    A fixed set of warm LaTeXML servers, one per concurrent conversion. Without the latexmls
+    plugin (or with 'size' 0), 'lease' yields None and callers fall back to cold 'latexmlc'
+    runs. So does a lease of a server that is down: starting one with heavy preloads takes
+    minutes, which a request should not wait for, so it is restarted in the background.
+    """
+
+    def __init__(
+        self, size: int, base_port: int, preloads: List[str], autoflush: int, max_rss: int,
+        startup_timeout: float = 120,
+    ) -> None:
+        self.enabled = size > 0 and shutil.which("latexmls") is not None
+        if size > 0 and not self.enabled:
+            logging.warning("latexmls not found, LaTeXML runs will start cold.")
+        self.daemons = [
+            LatexmlDaemon(base_port + i, preloads, autoflush, max_rss, startup_timeout)
+            for i in range(size)
+        ] if self.enabled else []
+        self._free: "queue.Queue[LatexmlDaemon]" = queue.Queue()
+        for daemon in self.daemons:
+            self._free.put(daemon)
+
+    def warm(self) -> List[threading.Thread]:
+        " Start all servers in the background, so that the first requests find them loaded. "
+        return [daemon.ensure_running_in_background() for daemon in self.daemons]
+
+    @contextmanager
+    def lease(self) -> Iterator[Optional[LatexmlDaemon]]:
+        if not self.enabled:
+            yield None
+            return
+        daemon = self._free.get()
+        try:
+            if daemon.healthy():
+                yield daemon
+            else:
+                daemon.ensure_running_in_background()
+                yield None
+        finally:
+            self._free.put(daemon)
+
+    def stop(self) -> None:
+        for daemon in self.daemons:
+            daemon.stop()
@@ -0,0 +1,33 @@
+import posixpath
+from typing import Iterable, List
+
+LINKED_EXTENSIONS = (
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".pdf", ".eps", ".ps",
+    ".ttf", ".otf", ".pfb", ".pfm", ".afm", ".tfm", ".vf",
+)
+"""
+Read-only binary assets (figures and fonts), which copies of a source tree may share as hard
+links. A compile may rewrite any other file in place, whatever its type.
+"""
+
+OUTPUT_EXTENSIONS = (".pdf", ".ps")
+" Figure formats that are also compile outputs, written next to the .tex file of their name. "
+
+
+def linked_paths(paths: Iterable[str]) -> List[str]:
+    """
+    The relative POSIX paths of a source tree that can be hard-linked between copies. PDF and
+    PostScript files named like a .tex file (e.g. a precompiled 'ms.pdf' next to 'ms.tex')
+    are left out, since the compile opens them for writing and would truncate the original.
+    """
+    paths = list(paths)
+    tex_stems = {posixpath.splitext(p.lower())[0] for p in paths if p.lower().endswith(".tex")}
+    linked = []
+    for path in paths:
+        stem, extension = posixpath.splitext(path.lower())
+        if extension not in LINKED_EXTENSIONS:
+            continue
+        if extension in OUTPUT_EXTENSIONS and stem in tex_stems:
+            continue
+        linked.append(path)
+    return linked
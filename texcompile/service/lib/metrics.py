@@ -0,0 +1,161 @@
+import abc
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple, TypeVar, Union
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+" Media type of the Prometheus text exposition format. "
+
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 2400)
+" Seconds. LaTeXML runs alone may take up to 40 minutes. "
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(abc.ABC):
+    type_ = "untyped"
+
+    def __init__(self, name: str, help_: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, labels: Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        " (sample name, labels, value) triples, in the order they are rendered. "
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, help_: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help_, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self.values.get(self._labels(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, value) for labels, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """
+    Gauge read when the metrics are rendered. 'collect' returns the value, or a dict from
+    label values (a tuple in the order of 'labelnames') to values.
+    """
+
+    type_ = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help_: str,
+        collect: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+        labelnames: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, help_, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            return [(self.name, (), values)]
+        return [
+            (self.name, tuple(zip(self.labelnames, key)), value)
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts: Dict[Labels, List[int]] = {}
+        self.sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            counts = self.counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labels, counts in sorted(self.counts.items()):
+                for bound, count in zip(self.buckets, counts):
+                    le = (("le", _format_value(bound)),)
+                    samples.append((self.name + "_bucket", labels + le, count))
+                samples.append((self.name + "_sum", labels, self.sums[labels]))
+                samples.append((self.name + "_count", labels, counts[-1]))
+        return samples
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class Registry:
+    """
+    Metrics exposed on '/metrics' in the Prometheus text format. Implements only the small
+    part of the format the service needs, so that it has no client library dependency.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: M) -> M:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
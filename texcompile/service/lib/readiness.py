@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+WARM_UP_TEX = r"""\documentclass{article}
+\begin{document}
+Ready.
+\end{document}
+"""
+" Trivial document compiled at startup, to check that TeX works and to warm its file caches. "
+
+
+class Readiness:
+    """
+    Whether the service can take compiles. The service starts out 'starting'; a warm-up check
+    run in the background (see 'start') then makes it 'ready', or 'failed' if the check raises.
+    """
+
+    def __init__(self) -> None:
+        self.state = "starting"
+        self.detail = ""
+        self.started = time.time()
+        self.finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self, check: Callable[[], None]) -> threading.Thread:
+        def run() -> None:
+            try:
+                check()
+            except Exception as e:
+                logging.exception("Warm-up check failed.")
+                self._finish("failed", str(e))
+            else:
+                self._finish("ready", "")
+
+        thread = threading.Thread(target=run, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def _finish(self, state: str, detail: str) -> None:
+        with self._lock:
+            self.state = state
+            self.detail = detail
+            self.finished = time.time()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                "status": self.state,
+                "detail": self.detail,
+                "seconds": (self.finished or time.time()) - self.started,
+            }
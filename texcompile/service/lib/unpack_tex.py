@@ -11,6 +11,7 @@ def unpack_archive(archive_path: str, dest_dir: str) -> None:
     For permissible arXiv source formats, see the 'Other formats' page for an arXiv paper.
     At the time of writing, the sources could be any of the following:
     * If multiple files, a gzipped tar
+    * An uncompressed tar, as sent by the client with compression disabled
     * A PDF
     * A gzipped TeX, DVI, PostScript, or DVI file
     """
@@ -23,7 +24,7 @@ def unpack_archive(archive_path: str, dest_dir: str) -> None:
     # archive-checking code misses some corner cases. The AutoTeX documentation implies that arXiv
     # quarantines TeX and the compilation process using chroot.
     try:
-        with tarfile.open(archive_path, mode="r:gz") as archive:
+        with tarfile.open(archive_path, mode="r:*") as archive:
             archive.extractall(dest_dir, members=get_safe_files(archive, dest_dir))
             logging.debug("Unpacked %s as a tar archive", archive_path)
         return
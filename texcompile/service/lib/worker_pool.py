@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class ServiceBusy(Exception):
+    """
+    Raised when a compile is submitted while all workers are busy and the queue is full.
+    """
+
+
+class WorkerPool:
+    """
+    Run blocking compiles off the event loop on a fixed number of worker threads. Compiles
+    spend their time in TeX/LaTeXML subprocesses, so threads are enough to run them in parallel.
+    At most `workers + queue_size` compiles are admitted at once; further submissions fail
+    immediately with `ServiceBusy` instead of waiting, so that the client can try another
+    container.
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compile")
+        self.admitted = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            admitted = self.admitted
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "running": min(admitted, self.workers),
+            "queued": max(admitted - self.workers, 0),
+        }
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self.admitted >= self.capacity:
+                raise ServiceBusy(
+                    f"All {self.workers} workers are busy and {self.queue_size} compiles are queued."
+                )
+            self.admitted += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self.admitted -= 1
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        """
+        Admit a call and schedule it on a worker, raising `ServiceBusy` when full.
+        """
+        self._admit()
+        try:
+            future = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # Release on completion rather than when the request ends: a compile whose client went
+        # away keeps its worker until the subprocess is done.
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
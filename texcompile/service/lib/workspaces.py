@@ -0,0 +1,131 @@
+import os
+import os.path
+import posixpath
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from lib.links import linked_paths
+from lib.unpack_tex import unpack_archive
+
+Path = str
+
+
+def _safe_path(name: str) -> Optional[str]:
+    path = posixpath.normpath(name.replace("\\", "/"))
+    if path.startswith("/") or path == ".." or path.startswith("../") or path == ".":
+        return None
+    return path
+
+
+@dataclass
+class Workspace:
+    id: str
+    directory: Path
+    " The unpacked original sources. Never modified after the upload. "
+    created: float = field(default_factory=time.time)
+    used: float = field(default_factory=time.time)
+
+    def files(self) -> List[str]:
+        files = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                files.append(os.path.relpath(os.path.join(dirpath, filename), self.directory))
+        return files
+
+    def status(self) -> Dict:
+        files = self.files()
+        return {
+            "id": self.id,
+            "files": len(files),
+            "size": sum(os.path.getsize(os.path.join(self.directory, f)) for f in files),
+            "created": self.created,
+            "used": self.used,
+        }
+
+    def materialize(
+        self, dest_dir: Path, overlay_filename: Optional[Path] = None, deleted: Iterable[str] = ()
+    ) -> None:
+        """
+        Build a compile variant in 'dest_dir': the original sources, minus the 'deleted'
+        paths, plus the files of the overlay archive. Assets (see 'linked_paths') are hard
+        links into the workspace; overlay files replace directory entries instead of writing through links.
+        """
+        self.used = time.time()
+        deleted = {path for path in map(_safe_path, deleted) if path is not None}
+        files = self.files()
+        linked = set(linked_paths(relpath.replace(os.path.sep, "/") for relpath in files))
+        for relpath in files:
+            if relpath.replace(os.path.sep, "/") in deleted:
+                continue
+            source = os.path.join(self.directory, relpath)
+            dest = os.path.join(dest_dir, relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if relpath.replace(os.path.sep, "/") not in linked:
+                shutil.copyfile(source, dest)
+                continue
+            try:
+                os.link(source, dest)
+            except OSError:
+                shutil.copyfile(source, dest)
+
+        if overlay_filename is None:
+            return
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(dest_dir.rstrip(os.path.sep))) as tmp:
+            unpack_archive(overlay_filename, tmp)
+            for dirpath, _, filenames in os.walk(tmp):
+                for filename in filenames:
+                    source = os.path.join(dirpath, filename)
+                    dest = os.path.join(dest_dir, os.path.relpath(source, tmp))
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(source, dest)
+
+
+class WorkspaceStore:
+    """
+    Original source trees uploaded once per paper, from which the compile variants of the
+    paper are materialized (see 'Workspace.materialize'). Workspaces unused for
+    'keep_seconds' are removed.
+    """
+
+    def __init__(self, directory: Path, keep_seconds: float = 3600) -> None:
+        self.directory = directory
+        self.keep_seconds = keep_seconds
+        self.workspaces: Dict[str, Workspace] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, sources_filename: Path) -> Workspace:
+        self.prune()
+        workspace_id = uuid.uuid4().hex
+        workspace = Workspace(workspace_id, os.path.join(self.directory, workspace_id))
+        unpack_archive(sources_filename, workspace.directory)
+        with self._lock:
+            self.workspaces[workspace_id] = workspace
+        return workspace
+
+    def get(self, workspace_id: str) -> Optional[Workspace]:
+        with self._lock:
+            return self.workspaces.get(workspace_id)
+
+    def delete(self, workspace_id: str) -> Optional[Workspace]:
+        with self._lock:
+            workspace = self.workspaces.pop(workspace_id, None)
+        if workspace is not None:
+            shutil.rmtree(workspace.directory, ignore_errors=True)
+        return workspace
+
+    def prune(self) -> List[str]:
+        cutoff = time.time() - self.keep_seconds
+        with self._lock:
+            expired = [
+                workspace_id for workspace_id, workspace in self.workspaces.items()
+                if workspace.used < cutoff
+            ]
+        for workspace_id in expired:
+            self.delete(workspace_id)
+        return expired
@@ -1,48 +1,546 @@
+import base64
+import json
 import os.path
+import shutil
 import tempfile
+import time
 from configparser import ConfigParser
+from typing import Callable, Optional
 
 import aiofiles
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 
-from lib.compile_autotex import compile_autotex
-from lib.compile_latexml import compile_latexml
+from lib.artifact_cache import ArtifactCache
+from lib.aux_store import AuxStore
+from lib.compile_autotex import compile_autotex_dir
+from lib.compile_latexml import compile_latexml_dir
+from lib.format_cache import FormatCache
+from lib.jobs import Job, JobStore
+from lib.latexml_daemon import LatexmlDaemonPool
+from lib.metrics import CONTENT_TYPE, Counter, Gauge, Histogram, Registry
+from lib.readiness import WARM_UP_TEX, Readiness
+from lib.unpack_tex import unpack_archive
+from lib.worker_pool import ServiceBusy, WorkerPool
+from lib.workspaces import Workspace, WorkspaceStore
 
 app = FastAPI()
 
+_config = ConfigParser()
+_config.read("service_config.ini")
+pool = WorkerPool(
+    _config.getint("service", "workers", fallback=2),
+    _config.getint("service", "queue_size", fallback=2),
+)
+jobs = JobStore(
+    _config.get("jobs", "directory", fallback=os.path.join(tempfile.gettempdir(), "texcompile-jobs")),
+    _config.getfloat("jobs", "keep_seconds", fallback=3600),
+)
+latexml_daemons = LatexmlDaemonPool(
+    _config.getint("latexml", "daemons", fallback=pool.workers),
+    _config.getint("latexml", "base_port", fallback=3334),
+    _config.get("latexml", "preload", fallback="").split(),
+    _config.getint("latexml", "autoflush", fallback=100),
+    _config.getint("latexml", "max_rss_mb", fallback=4096) * 1024 ** 2,
+    _config.getfloat("latexml", "startup_timeout", fallback=600),
+)
+TMP_PATH = "/tmpfs/" if os.path.exists("/tmpfs") else None
+workspaces = WorkspaceStore(
+    _config.get(
+        "workspaces", "directory",
+        fallback=os.path.join(TMP_PATH or tempfile.gettempdir(), "texcompile-workspaces"),
+    ),
+    _config.getfloat("workspaces", "keep_seconds", fallback=3600),
+)
+_cache_directory = _config.get(
+    "cache", "directory", fallback=os.path.join(TMP_PATH or tempfile.gettempdir(), "texcompile-cache")
+)
+artifact_cache = ArtifactCache(
+    _cache_directory, _config.getint("cache", "max_bytes", fallback=2 * 1024 ** 3)
+) if _cache_directory else None
+_formats_directory = _config.get(
+    "formats", "directory", fallback=os.path.join(TMP_PATH or tempfile.gettempdir(), "texcompile-formats")
+)
+_aux_directory = _config.get(
+    "aux", "directory", fallback=os.path.join(TMP_PATH or tempfile.gettempdir(), "texcompile-aux")
+)
+aux_store = AuxStore(
+    _aux_directory, _config.getint("aux", "max_bytes", fallback=512 * 1024 ** 2)
+) if _aux_directory else None
+format_cache = FormatCache(
+    _formats_directory,
+    _config.getint("formats", "max_bytes", fallback=1024 ** 3),
+    _config["tex"]["texlive_path"],
+) if _formats_directory and _config.has_section("tex") else None
+
+RESULT_HEADER = "X-Texcompile-Result"
+MEDIA_TYPES = {"pdf": "application/pdf", "ps": "application/postscript", "html": "text/html"}
+PRIMARY_OUTPUT_TYPES = {"autotex": "pdf", "latexml": "html"}
+readiness = Readiness()
+
+
+def tmpfs_usage():
+    usage = shutil.disk_usage(TMP_PATH or tempfile.gettempdir())
+    return {("used",): usage.used, ("total",): usage.total}
+
+
+metrics = Registry()
+metrics.register(Gauge(
+    "texcompile_workers", "Compile worker threads.", lambda: pool.workers,
+))
+metrics.register(Gauge(
+    "texcompile_compiles_in_flight", "Compiles running on a worker.",
+    lambda: pool.stats()["running"],
+))
+metrics.register(Gauge(
+    "texcompile_compiles_queued", "Compiles admitted and waiting for a worker.",
+    lambda: pool.stats()["queued"],
+))
+metrics.register(Gauge(
+    "texcompile_jobs", "Asynchronous jobs by state.",
+    lambda: {(state,): count for state, count in jobs.counts().items()}, ["state"],
+))
+metrics.register(Gauge(
+    "texcompile_tmpfs_bytes", "Usage of the file system compiles run on.", tmpfs_usage, ["kind"],
+))
+compile_seconds = metrics.register(Histogram(
+    "texcompile_compile_seconds", "Duration of compiles that were not cached.", ["mode"],
+))
+compiles_total = metrics.register(Counter(
+    "texcompile_compiles_total",
+    "Compile results: 'success', 'has_output' (failed, but produced output) or 'failure'.",
+    ["mode", "result"],
+))
+cache_requests = metrics.register(Counter(
+    "texcompile_cache_requests_total", "Lookups of the artifact cache and seeds of the aux store.",
+    ["cache", "result"],
+))
+bytes_in = metrics.register(Counter(
+    "texcompile_received_bytes_total", "Uploaded sources, overlays included.",
+))
+bytes_out = metrics.register(Counter(
+    "texcompile_output_bytes_total", "Output files produced or served from the cache.", ["mode"],
+))
+
+
+@app.on_event("startup")
+def start_latexml_daemons():
+    latexml_daemons.warm()
+
+
+@app.on_event("startup")
+def start_warm_up():
+    readiness.start(warm_up)
+
+
+@app.on_event("shutdown")
+def stop_latexml_daemons():
+    latexml_daemons.stop()
+
+
+def warm_up() -> None:
+    """
+    Compile a trivial document with AutoTeX, bypassing all caches. Raises if that fails.
+    """
+    config = ConfigParser()
+    config.read("service_config.ini")
+    with tempfile.TemporaryDirectory(dir=TMP_PATH) as temp_directory:
+        sources_dir = os.path.join(temp_directory, "sources")
+        os.makedirs(sources_dir)
+        with open(os.path.join(sources_dir, "main.tex"), "w") as file_:
+            file_.write(WARM_UP_TEX)
+        json_result = compile_autotex_dir(
+            sources_dir,
+            config["tex"]["texlive_path"],
+            config["tex"]["system_path"],
+            config["perl"]["binary"],
+            encode_contents=False,
+        )
+    if not json_result["success"]:
+        raise RuntimeError("Warm-up compile failed: " + json_result["log"][-1000:])
+
+
+def compile_sources(
+    sources_filename: str,
+    autotex_or_latexml: str,
+    main_tex_file: str,
+    encode_contents: bool,
+    aux_key: str = "",
+    seed_key: str = "",
+):
+    """
+    Compile an uploaded archive with AutoTeX or LaTeXML, see 'compile_tree'.
+    """
+    return compile_tree(
+        lambda sources_dir: unpack_archive(sources_filename, sources_dir),
+        autotex_or_latexml, main_tex_file, encode_contents, aux_key, seed_key,
+    )
 
-@app.post("/")
-async def detect_upload_file(
-        sources: UploadFile = File(...), 
-        autotex_or_latexml: str = Form(...),
-        main_tex_file: str = Form(...)
-    ):
 
+def compile_tree(
+    prepare: Callable[[str], None],
+    autotex_or_latexml: str,
+    main_tex_file: str,
+    encode_contents: bool,
+    aux_key: str = "",
+    seed_key: str = "",
+):
+    """
+    Compile the sources that 'prepare' writes into a fresh directory with AutoTeX or LaTeXML.
+    Blocks until the compiler is done.
+    AutoTeX compiles with an 'aux_key' keep their auxiliary files under it, and are seeded
+    with the files stored under 'seed_key' (by default 'aux_key'), see 'AuxStore'.
+    Results of sources that were compiled before come from the artifact cache; the result's
+    'cache' field is "hit", "miss" or "off". Only results with output are cached, as failures
+    may be caused by the environment (e.g. running out of memory) rather than the sources.
+    """
     config = ConfigParser()
     config.read("service_config.ini")
     texlive_path = config["tex"]["texlive_path"]
     system_path = config["tex"]["system_path"]
     perl_binary = config["perl"]["binary"]
 
+    print("executing", autotex_or_latexml)
+    with tempfile.TemporaryDirectory(dir=TMP_PATH) as temp_directory:
+        sources_dir = os.path.join(temp_directory, "sources")
+        prepare(sources_dir)
+
+        json_result, key = None, None
+        if artifact_cache is not None:
+            key = artifact_cache.key(sources_dir, autotex_or_latexml, main_tex_file)
+            json_result = artifact_cache.get(key)
+        if json_result is not None:
+            json_result["cache"] = "hit"
+        else:
+            started = time.monotonic()
+            if autotex_or_latexml == "autotex":
+                json_result = compile_autotex_with_format(
+                    prepare, sources_dir, texlive_path, system_path, perl_binary, aux_key,
+                    seed_key,
+                )
+            else:
+                with latexml_daemons.lease() as daemon:
+                    json_result = compile_latexml_dir(
+                        sources_dir, main_tex_file, encode_contents=False, daemon=daemon,
+                    )
+            compile_seconds.observe(time.monotonic() - started, mode=autotex_or_latexml)
+            if key is not None and (json_result["success"] or json_result["has_output"]):
+                artifact_cache.put(key, json_result)
+            json_result["cache"] = "miss" if key is not None else "off"
+    record_result(json_result, autotex_or_latexml)
+
+    if encode_contents:
+        for output in json_result["output"]:
+            output["contents"] = base64.b64encode(output["contents"]).decode()
+    return json_result
+
+
+def record_result(json_result, autotex_or_latexml: str) -> None:
+    if json_result["success"]:
+        result = "success"
+    elif json_result["has_output"]:
+        result = "has_output"
+    else:
+        result = "failure"
+    compiles_total.inc(mode=autotex_or_latexml, result=result)
+    if json_result["cache"] != "off":
+        cache_requests.inc(cache="artifact", result=json_result["cache"])
+    bytes_out.inc(sum(len(o["contents"]) for o in json_result["output"]), mode=autotex_or_latexml)
+
+
+def compile_autotex_seeded(
+    sources_dir: str, texlive_path: str, system_path: str, perl_binary: str, aux_key: str,
+    seed_key: str = "",
+):
+    seed_key = seed_key or aux_key
+    if seed_key and aux_store is not None:
+        seeded = aux_store.seed(seed_key, sources_dir)
+        cache_requests.inc(cache="aux", result="hit" if seeded else "miss")
+    json_result = compile_autotex_dir(
+        sources_dir, texlive_path, system_path, perl_binary, encode_contents=False,
+    )
+    if aux_key and aux_store is not None and json_result["success"]:
+        aux_store.store(aux_key, sources_dir)
+    return json_result
+
+
+def compile_autotex_with_format(
+    prepare: Callable[[str], None],
+    sources_dir: str,
+    texlive_path: str,
+    system_path: str,
+    perl_binary: str,
+    aux_key: str = "",
+    seed_key: str = "",
+):
+    """
+    Compile with a precompiled format of the preamble (see 'FormatCache'). If that fails, the
+    sources are prepared again and compiled without one.
+    """
+    format_name = format_cache.apply(sources_dir, system_path) if format_cache else None
+    json_result = compile_autotex_seeded(
+        sources_dir, texlive_path, system_path, perl_binary, aux_key, seed_key
+    )
+    if format_name is None or json_result["success"]:
+        return json_result
+
+    print("compiling again without format", format_name)
+    with tempfile.TemporaryDirectory(dir=TMP_PATH) as temp_directory:
+        sources_dir = os.path.join(temp_directory, "sources")
+        prepare(sources_dir)
+        return compile_autotex_seeded(
+            sources_dir, texlive_path, system_path, perl_binary, aux_key, seed_key
+        )
+
+
+def check_mode(autotex_or_latexml: str) -> None:
+    if autotex_or_latexml not in PRIMARY_OUTPUT_TYPES:
+        raise HTTPException(
+            status_code=422, detail=f"Unknown compiler {autotex_or_latexml!r}."
+        )
+
+
+def binary_response(json_result, output_type: str):
+    """
+    Return the first output of 'output_type' as the raw response body, with the remaining
+    metadata as JSON in a header. Without such an output, fall back to the JSON result (whose
+    log the client needs for its error message), with contents stripped.
+    """
+    for output in json_result["output"]:
+        if output["type"] == output_type:
+            meta = {
+                "success": json_result["success"],
+                "has_output": json_result["has_output"],
+                "main_tex_files": json_result["main_tex_files"],
+                "type": output["type"],
+                "path": output["path"],
+                "cache": json_result.get("cache"),
+            }
+            return Response(
+                content=output["contents"],
+                media_type=MEDIA_TYPES.get(output_type, "application/octet-stream"),
+                headers={RESULT_HEADER: json.dumps(meta)},
+            )
+    return {
+        **json_result,
+        "output": [
+            {"type": o["type"], "path": o["path"], "contents": ""} for o in json_result["output"]
+        ],
+    }
+
+
+def busy_response(e: ServiceBusy):
+    " 503 with an explicit busy status, so that clients can route the request elsewhere. "
+    return JSONResponse(
+        status_code=503,
+        content={"status": "busy", "detail": str(e), **pool.stats()},
+        headers={"Retry-After": "1"},
+    )
+
+
+@app.get("/healthz")
+async def healthz():
+    " The service process is up and answers requests. "
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    " Compiles can be sent: the warm-up compile at startup succeeded. 503 until then. "
+    status = readiness.status()
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=status)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/status")
+async def status():
+    " Load of the compile workers, polled by client-side balancers to pick an endpoint. "
+    return {"status": "ok", "ready": readiness.ready, **pool.stats(), "jobs": jobs.counts()}
+
+
+@app.post("/")
+async def detect_upload_file(
+        sources: UploadFile = File(...), 
+        autotex_or_latexml: str = Form(...),
+        main_tex_file: str = Form(...),
+        response_format: str = Form("json"),
+        aux_key: str = Form(""),
+        seed_key: str = Form(""),
+    ):
+    """
+    'response_format' is "json" (every output file base64-encoded in a JSON body) or "binary"
+    (the main PDF or HTML file as the raw body, see 'binary_response'). The .aux/.bbl files of
+    a compile are kept under 'aux_key' (e.g. the paper id and variant), and it is seeded with
+    those kept under 'seed_key' (e.g. of the paper's plain variant; by default 'aux_key').
+    """
+    check_mode(autotex_or_latexml)
+    binary = response_format == "binary"
+
     with tempfile.TemporaryDirectory() as tempdir:
-        print("executing", autotex_or_latexml)
         sources_filename = os.path.join(tempdir, "sources")
         async with aiofiles.open(sources_filename, "wb") as sources_file:
             content = await sources.read()  # async read
+            bytes_in.inc(len(content))
             await sources_file.write(content)  # async write
-        if autotex_or_latexml == "autotex":
-            json_result = compile_autotex(
-                sources_filename, texlive_path, system_path, perl_binary
+        # Compiles block on subprocesses, so they run on the worker pool to keep the event
+        # loop responsive.
+        try:
+            json_result = await pool.run(
+                compile_sources, sources_filename, autotex_or_latexml, main_tex_file,
+                encode_contents=not binary, aux_key=aux_key, seed_key=seed_key,
             )
-            return json_result
-        elif autotex_or_latexml == "latexml":
-            json_result = compile_latexml(
-                sources_filename, main_tex_file
+        except ServiceBusy as e:
+            return busy_response(e)
+        if binary:
+            return binary_response(json_result, PRIMARY_OUTPUT_TYPES[autotex_or_latexml])
+        return json_result
+
+
+def get_job(job_id: str) -> Job:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return job
+
+
+def run_job(job: Job) -> None:
+    jobs.run(job, lambda job: compile_sources(
+        job.sources_filename, job.autotex_or_latexml, job.main_tex_file, encode_contents=False,
+        aux_key=job.aux_key, seed_key=job.seed_key,
+    ))
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+        sources: UploadFile = File(...),
+        autotex_or_latexml: str = Form(...),
+        main_tex_file: str = Form(...),
+        aux_key: str = Form(""),
+        seed_key: str = Form(""),
+    ):
+    """
+    Start a compile without waiting for it. Returns the job status, whose 'id' is used to
+    poll 'GET /jobs/{id}' and to fetch the result from 'GET /jobs/{id}/output'.
+    """
+    check_mode(autotex_or_latexml)
+    job = jobs.create(autotex_or_latexml, main_tex_file, aux_key, seed_key)
+    async with aiofiles.open(job.sources_filename, "wb") as sources_file:
+        content = await sources.read()
+        bytes_in.inc(len(content))
+        await sources_file.write(content)
+    try:
+        pool.submit(run_job, job)
+    except ServiceBusy as e:
+        jobs.delete(job.id)
+        return busy_response(e)
+    return job.status()
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, log_lines: int = 50):
+    return get_job(job_id).status(log_lines)
+
+
+@app.get("/jobs/{job_id}/output")
+async def job_output(job_id: str):
+    """
+    The main PDF or HTML file of a finished job, as for 'response_format="binary"'.
+    """
+    job = get_job(job_id)
+    if job.state == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.state != "done":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.state}.")
+    return binary_response(job.result, PRIMARY_OUTPUT_TYPES[job.autotex_or_latexml])
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    job = jobs.delete(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return job.status()
+
+
+def get_workspace(workspace_id: str) -> Workspace:
+    workspace = workspaces.get(workspace_id)
+    if workspace is None:
+        raise HTTPException(status_code=404, detail=f"Unknown workspace {workspace_id}.")
+    return workspace
+
+
+@app.post("/workspaces", status_code=201)
+async def create_workspace(sources: UploadFile = File(...)):
+    """
+    Upload the original sources of a paper once. Its compile variants are then sent to
+    'POST /workspaces/{id}/compile' as overlays of changed files.
+    """
+    with tempfile.TemporaryDirectory() as tempdir:
+        sources_filename = os.path.join(tempdir, "sources")
+        async with aiofiles.open(sources_filename, "wb") as sources_file:
+            content = await sources.read()
+            bytes_in.inc(len(content))
+            await sources_file.write(content)
+        workspace = await run_in_threadpool(workspaces.create, sources_filename)
+    return workspace.status()
+
+
+@app.post("/workspaces/{workspace_id}/compile")
+async def compile_workspace(
+        workspace_id: str,
+        autotex_or_latexml: str = Form(...),
+        main_tex_file: str = Form(...),
+        response_format: str = Form("json"),
+        aux_key: str = Form(""),
+        seed_key: str = Form(""),
+        deleted: str = Form("[]"),
+        overlay: Optional[UploadFile] = File(None),
+    ):
+    """
+    Compile the workspace's sources with the files of the 'overlay' archive added or
+    replaced and the paths in 'deleted' (a JSON list) removed. Otherwise like 'POST /'.
+    """
+    check_mode(autotex_or_latexml)
+    workspace = get_workspace(workspace_id)
+    binary = response_format == "binary"
+    try:
+        deleted_paths = json.loads(deleted)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="'deleted' must be a JSON list of paths.")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        overlay_filename = None
+        if overlay is not None:
+            overlay_filename = os.path.join(tempdir, "overlay")
+            async with aiofiles.open(overlay_filename, "wb") as overlay_file:
+                content = await overlay.read()
+                bytes_in.inc(len(content))
+                await overlay_file.write(content)
+        try:
+            json_result = await pool.run(
+                compile_tree,
+                lambda sources_dir: workspace.materialize(sources_dir, overlay_filename, deleted_paths),
+                autotex_or_latexml, main_tex_file,
+                encode_contents=not binary, aux_key=aux_key, seed_key=seed_key,
             )
-            return json_result
-        else:
-            pass
+        except ServiceBusy as e:
+            return busy_response(e)
+    if binary:
+        return binary_response(json_result, PRIMARY_OUTPUT_TYPES[autotex_or_latexml])
+    return json_result
+
+
+@app.delete("/workspaces/{workspace_id}")
+async def delete_workspace(workspace_id: str):
+    status = get_workspace(workspace_id).status()
+    workspaces.delete(workspace_id)
+    return status
 
 
 if __name__ == "__main__":
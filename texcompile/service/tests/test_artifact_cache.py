@@ -0,0 +1,53 @@
+import os
+import time
+
+from lib.artifact_cache import ArtifactCache
+
+
+def make_sources(directory, text):
+    os.makedirs(os.path.join(directory, "figures"))
+    with open(os.path.join(directory, "main.tex"), "w") as file_:
+        file_.write(text)
+    with open(os.path.join(directory, "figures", "plot.pdf"), "wb") as file_:
+        file_.write(b"%PDF")
+    return str(directory)
+
+
+def make_result(contents):
+    return {
+        "success": True,
+        "has_output": True,
+        "main_tex_files": ["main.tex"],
+        "log": "log",
+        "output": [{"type": "pdf", "path": "main.pdf", "contents": contents}],
+    }
+
+
+def test_key_depends_on_contents_and_mode(tmp_path):
+    cache = ArtifactCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    first = make_sources(tmp_path / "first", "hello")
+    same = make_sources(tmp_path / "same", "hello")
+    other = make_sources(tmp_path / "other", "world")
+
+    assert cache.key(first, "autotex") == cache.key(same, "autotex")
+    assert cache.key(first, "autotex") != cache.key(other, "autotex")
+    assert cache.key(first, "autotex") != cache.key(first, "latexml", "main.tex")
+
+
+def test_put_get_and_evict(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=2500)
+    assert cache.get("a") is None
+
+    cache.put("a", make_result(b"a" * 1000))
+    assert cache.get("a") == make_result(b"a" * 1000)
+
+    time.sleep(0.01)
+    cache.put("b", make_result(b"b" * 1000))
+    time.sleep(0.01)
+    cache.get("a") # 'a' is now more recently used than 'b'
+    time.sleep(0.01)
+    cache.put("c", make_result(b"c" * 1000))
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
@@ -0,0 +1,82 @@
+import os
+
+from lib.aux_store import AuxStore
+
+
+def write(path, contents):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file_:
+        file_.write(contents)
+
+
+def read(path):
+    with open(path) as file_:
+        return file_.read()
+
+
+def test_store_and_seed(tmp_path):
+    store = AuxStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    first = str(tmp_path / "first")
+    write(os.path.join(first, "main.tex"), "tex")
+    write(os.path.join(first, "main.aux"), "aux")
+    write(os.path.join(first, "main.bbl"), "bbl")
+    write(os.path.join(first, "sections", "intro.aux"), "intro aux")
+    store.store("paper", first)
+
+    second = str(tmp_path / "second")
+    write(os.path.join(second, "main.tex"), "tex")
+    write(os.path.join(second, "main.bbl"), "uploaded bbl")
+    seeded = store.seed("paper", second)
+
+    assert sorted(seeded) == ["main.aux", os.path.join("sections", "intro.aux")]
+    assert read(os.path.join(second, "main.aux")) == "aux"
+    assert read(os.path.join(second, "main.bbl")) == "uploaded bbl" # uploads take precedence
+    assert not os.path.exists(os.path.join(str(tmp_path / "store"), "main.tex"))
+    assert store.seed("other paper", second) == []
+
+
+def test_contents_files_are_not_seeded(tmp_path):
+    store = AuxStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    first = str(tmp_path / "first")
+    write(os.path.join(first, "main.aux"), "aux")
+    for extension in (".toc", ".lof", ".lot", ".out"):
+        write(os.path.join(first, "main" + extension), "stale contents")
+    store.store("paper-colored", first)
+
+    second = str(tmp_path / "second")
+    os.makedirs(second)
+    assert store.seed("paper-colored", second) == ["main.aux"]
+
+
+def test_store_replaces_previous_files(tmp_path):
+    store = AuxStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    first = str(tmp_path / "first")
+    write(os.path.join(first, "old.aux"), "old")
+    store.store("paper", first)
+    second = str(tmp_path / "second")
+    write(os.path.join(second, "new.aux"), "new")
+    store.store("paper", second)
+
+    target = str(tmp_path / "target")
+    os.makedirs(target)
+    assert store.seed("paper", target) == ["new.aux"]
+
+
+def test_variants_seed_from_plain_and_keep_their_own(tmp_path):
+    store = AuxStore(str(tmp_path / "store"), max_bytes=1 << 20)
+    plain = str(tmp_path / "plain")
+    write(os.path.join(plain, "main.aux"), "plain aux")
+    store.store("paper-plain", plain)
+
+    for variant in ("colored", "black"):
+        directory = str(tmp_path / variant)
+        os.makedirs(directory)
+        assert store.seed("paper-plain", directory) == ["main.aux"]
+        write(os.path.join(directory, "main.aux"), variant + " aux")
+        store.store("paper-" + variant, directory)
+
+    for key, contents in [("paper-plain", "plain aux"), ("paper-colored", "colored aux")]:
+        target = str(tmp_path / ("target-" + key))
+        os.makedirs(target)
+        store.seed(key, target)
+        assert read(os.path.join(target, "main.aux")) == contents
@@ -0,0 +1,74 @@
+import os
+
+from lib.format_cache import FormatCache, find_main_file
+
+MAIN = b"""\\documentclass{article}
+\\usepackage{macros}
+\\input{defs}
+\\begin{document}
+%s
+\\end{document}
+"""
+
+
+def make_sources(directory, body=b"Hello.", macros=b"\\newcommand{\\x}{x}"):
+    os.makedirs(directory)
+    with open(os.path.join(directory, "main.tex"), "wb") as file_:
+        file_.write(MAIN % body)
+    with open(os.path.join(directory, "section.tex"), "wb") as file_:
+        file_.write(b"\\section{Intro}")
+    with open(os.path.join(directory, "defs.tex"), "wb") as file_:
+        file_.write(b"\\def\\y{y}")
+    with open(os.path.join(directory, "macros.sty"), "wb") as file_:
+        file_.write(macros)
+    return str(directory)
+
+
+def test_find_main_file(tmp_path):
+    sources = make_sources(tmp_path / "sources")
+    assert find_main_file(sources) == "main.tex"
+
+
+def test_key_depends_on_preamble_only(tmp_path):
+    cache = FormatCache(str(tmp_path / "formats"), 1 << 30, "/usr/local/texlive/2022")
+    first = make_sources(tmp_path / "first")
+    other_body = make_sources(tmp_path / "other_body", body=b"Colored.")
+    other_macros = make_sources(tmp_path / "other_macros", macros=b"\\newcommand{\\x}{z}")
+
+    assert cache.key(first, "main.tex") == cache.key(other_body, "main.tex")
+    assert cache.key(first, "main.tex") != cache.key(other_macros, "main.tex")
+
+
+def test_apply_cached_format(tmp_path):
+    cache = FormatCache(str(tmp_path / "formats"), 1 << 30, "/usr/local/texlive/2022")
+    sources = make_sources(tmp_path / "sources")
+    name = "texcompile-" + cache.key(sources, "main.tex")[:24]
+    with open(os.path.join(cache.directory, name + ".fmt"), "wb") as file_:
+        file_.write(b"format")
+
+    assert cache.apply(sources, "") == name
+    with open(os.path.join(sources, "main.tex"), "rb") as file_:
+        assert file_.readline() == b"%&" + name.encode() + b"\n"
+    assert os.path.exists(os.path.join(sources, name + ".fmt"))
+
+
+def test_apply_falls_back_when_dump_fails(tmp_path):
+    cache = FormatCache(str(tmp_path / "formats"), 1 << 30, "/usr/local/texlive/2022")
+    sources = make_sources(tmp_path / "sources")
+    # without pdftex on the path, dumping fails and the sources stay untouched
+    assert cache.apply(sources, str(tmp_path / "empty")) is None
+    with open(os.path.join(sources, "main.tex"), "rb") as file_:
+        assert file_.read() == MAIN % b"Hello."
+
+
+def test_key_covers_injected_packages(tmp_path):
+    # the annotated passes load xcolor, which must be in their format but not in the plain one
+    cache = FormatCache(str(tmp_path / "formats"), 1 << 30, "/usr/local/texlive/2022")
+    plain = make_sources(tmp_path / "plain")
+    colored = make_sources(tmp_path / "colored")
+    main = os.path.join(colored, "main.tex")
+    with open(main, "rb") as file_:
+        contents = file_.read()
+    with open(main, "wb") as file_:
+        file_.write(contents.replace(b"\\input{defs}\n", b"\\input{defs}\n\\usepackage{xcolor}\n"))
+    assert cache.key(plain, "main.tex") != cache.key(colored, "main.tex")
@@ -0,0 +1,41 @@
+import os.path
+import time
+
+from lib.jobs import JobStore
+
+
+def test_run_job(tmp_path):
+    store = JobStore(str(tmp_path))
+    job = store.create("autotex", " ")
+    with open(job.sources_filename, "wb") as file_:
+        file_.write(b"sources")
+
+    def compile_fn(job):
+        with open(job.sources_filename, "rb") as file_:
+            assert file_.read() == b"sources"
+        return {
+            "success": True,
+            "has_output": True,
+            "main_tex_files": ["main.tex"],
+            "log": "first\nsecond\nthird",
+            "output": [{"type": "pdf", "path": "main.pdf", "contents": b"%PDF"}],
+        }
+
+    store.run(job, compile_fn)
+    status = store.get(job.id).status(log_lines=2)
+    assert status["state"] == "done"
+    assert status["outputs"] == [{"type": "pdf", "path": "main.pdf"}]
+    assert status["log_tail"] == "second\nthird"
+    assert not os.path.exists(job.directory)
+
+
+def test_failed_job_and_expiry(tmp_path):
+    store = JobStore(str(tmp_path), keep_seconds=0)
+    job = store.create("latexml", "main.tex")
+    store.run(job, lambda job: 1 / 0)
+    assert job.state == "failed"
+    assert job.error.startswith("ZeroDivisionError")
+
+    time.sleep(0.01)
+    assert store.prune() == [job.id]
+    assert store.get(job.id) is None
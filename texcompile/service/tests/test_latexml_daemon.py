@@ -0,0 +1,61 @@
+import os
+import socket
+import stat
+import sys
+
+from lib.latexml_daemon import LatexmlDaemon, LatexmlDaemonPool
+
+FAKE_LATEXMLS = """#!{python}
+import socket, sys
+port = int([a for a in sys.argv if a.startswith("--port=")][0].split("=")[1])
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(("127.0.0.1", port))
+server.listen()
+while True:
+    server.accept()[0].close()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_pool_without_latexmls(monkeypatch):
+    monkeypatch.setenv("PATH", "")
+    pool = LatexmlDaemonPool(2, 3334, [], autoflush=100, max_rss=0)
+    with pool.lease() as daemon:
+        assert daemon is None
+
+
+def test_daemon_restarts(tmp_path, monkeypatch):
+    script = tmp_path / "latexmls"
+    script.write_text(FAKE_LATEXMLS.format(python=sys.executable))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+
+    pool = LatexmlDaemonPool(1, free_port(), ["amsmath.sty"], autoflush=100, max_rss=0)
+    try:
+        with pool.lease() as daemon:
+            assert daemon is None # not started yet, the request goes cold
+        for thread in pool.warm():
+            thread.join()
+        with pool.lease() as daemon:
+            assert daemon is not None
+            assert "--preload=amsmath.sty" in daemon.command()
+            first = daemon.process.pid
+        daemon.process.kill()
+        daemon.process.wait()
+        with pool.lease() as leased:
+            assert leased is None
+        daemon.ensure_running_in_background().join()
+        with pool.lease() as daemon:
+            assert daemon.healthy()
+            assert daemon.process.pid != first
+
+        daemon.max_rss = 1 # any process is larger
+        assert not daemon.healthy()
+    finally:
+        pool.stop()
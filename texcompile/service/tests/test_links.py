@@ -0,0 +1,12 @@
+from lib.links import linked_paths
+
+
+def test_only_assets_are_linked():
+    assert linked_paths([
+        "main.tex", "refs.bib", "table.dat", "figures/plot.png", "figures/plot.pdf", "font.otf",
+    ]) == ["figures/plot.png", "figures/plot.pdf", "font.otf"]
+
+
+def test_outputs_of_tex_files_are_not_linked():
+    paths = ["ms.tex", "ms.pdf", "MS.ps", "sub/ms.pdf", "figure.pdf"]
+    assert linked_paths(paths) == ["sub/ms.pdf", "figure.pdf"]
@@ -0,0 +1,47 @@
+import pytest
+
+from lib.metrics import Counter, Gauge, Histogram, Metric, Registry
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    compiles = registry.register(Counter("compiles_total", "Compiles.", ["mode"]))
+    registry.register(Gauge("queued", "Queued compiles.", lambda: 3))
+    compiles.inc(mode="autotex")
+    compiles.inc(2, mode="latexml")
+    compiles.inc(mode="autotex")
+    assert compiles.get(mode="autotex") == 2
+    assert registry.render() == (
+        "# HELP compiles_total Compiles.\n"
+        "# TYPE compiles_total counter\n"
+        'compiles_total{mode="autotex"} 2\n'
+        'compiles_total{mode="latexml"} 2\n'
+        "# HELP queued Queued compiles.\n"
+        "# TYPE queued gauge\n"
+        "queued 3\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("seconds", "Durations.", ["mode"], buckets=[1, 10])
+    histogram.observe(0.5, mode="autotex")
+    histogram.observe(5, mode="autotex")
+    histogram.observe(50, mode="autotex")
+    assert histogram.render()[2:] == [
+        'seconds_bucket{mode="autotex",le="1"} 1',
+        'seconds_bucket{mode="autotex",le="10"} 2',
+        'seconds_bucket{mode="autotex",le="+Inf"} 3',
+        'seconds_sum{mode="autotex"} 55.5',
+        'seconds_count{mode="autotex"} 3',
+    ]
+
+
+def test_labels_must_match():
+    counter = Counter("compiles_total", "Compiles.", ["mode"])
+    with pytest.raises(ValueError):
+        counter.inc(result="success")
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("untyped", "Needs samples.")
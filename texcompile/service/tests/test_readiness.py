@@ -0,0 +1,26 @@
+import threading
+
+from lib.readiness import Readiness
+
+
+def test_ready_after_check():
+    readiness = Readiness()
+    release = threading.Event()
+    thread = readiness.start(release.wait)
+    assert readiness.status()["status"] == "starting"
+    assert not readiness.ready
+    release.set()
+    thread.join()
+    assert readiness.ready
+    assert readiness.status()["detail"] == ""
+
+
+def test_failed_check():
+    def check():
+        raise RuntimeError("pdflatex not found")
+
+    readiness = Readiness()
+    readiness.start(check).join()
+    assert not readiness.ready
+    assert readiness.status()["status"] == "failed"
+    assert readiness.status()["detail"] == "pdflatex not found"
@@ -0,0 +1,34 @@
+import gzip
+import io
+import os
+import tarfile
+
+from lib.unpack_tex import unpack_archive
+
+
+def _make_tar(path, mode, files):
+    with tarfile.open(path, mode) as archive:
+        for name, contents in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            archive.addfile(info, io.BytesIO(contents))
+
+
+def test_unpack_gzipped_tar(tmp_path):
+    _make_tar(tmp_path / "sources", "w:gz", {"main.tex": b"tex", "fig/a.png": b"png"})
+    unpack_archive(str(tmp_path / "sources"), str(tmp_path / "out"))
+    assert (tmp_path / "out" / "main.tex").read_bytes() == b"tex"
+    assert (tmp_path / "out" / "fig" / "a.png").read_bytes() == b"png"
+
+
+def test_unpack_uncompressed_tar(tmp_path):
+    _make_tar(tmp_path / "sources", "w", {"main.tex": b"tex"})
+    unpack_archive(str(tmp_path / "sources"), str(tmp_path / "out"))
+    assert (tmp_path / "out" / "main.tex").read_bytes() == b"tex"
+
+
+def test_unpack_gzipped_tex(tmp_path):
+    with gzip.open(tmp_path / "sources", "wb") as file_:
+        file_.write(b"\\documentclass{article}")
+    unpack_archive(str(tmp_path / "sources"), str(tmp_path / "out"))
+    assert os.listdir(tmp_path / "out") == ["uncompressed"]
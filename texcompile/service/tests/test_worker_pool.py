@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+import pytest
+
+from lib.worker_pool import ServiceBusy, WorkerPool
+
+
+def test_run_returns_result():
+    pool = WorkerPool(workers=1, queue_size=0)
+    assert asyncio.run(pool.run(lambda x, y=0: x + y, 1, y=2)) == 3
+    assert pool.stats()["running"] == 0
+
+
+def test_reject_when_queue_is_full():
+    pool = WorkerPool(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def main():
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        assert pool.stats() == {"workers": 1, "queue_size": 1, "running": 1, "queued": 1}
+        with pytest.raises(ServiceBusy):
+            await pool.run(lambda: None)
+        release.set()
+        assert await queued == "queued"
+        await running
+
+    asyncio.run(main())
+    assert pool.stats()["queued"] == 0
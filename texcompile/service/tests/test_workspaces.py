@@ -0,0 +1,71 @@
+import io
+import os
+import tarfile
+
+from lib.workspaces import WorkspaceStore
+
+
+def make_archive(path, files):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, contents in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            tar.addfile(info, io.BytesIO(contents))
+    return str(path)
+
+
+def read(path):
+    with open(path, "rb") as file_:
+        return file_.read()
+
+
+def test_materialize_overlay(tmp_path):
+    store = WorkspaceStore(str(tmp_path / "workspaces"))
+    workspace = store.create(make_archive(tmp_path / "sources.tar.gz", {
+        "main.tex": b"original",
+        "figures/plot.png": b"png",
+        "old.tex": b"old",
+    }))
+    overlay = make_archive(tmp_path / "overlay.tar.gz", {
+        "main.tex": b"annotated",
+        "figures/plot.png": b"replaced",
+        "new.sty": b"sty",
+    })
+    variant = str(tmp_path / "variant" / "sources")
+    os.makedirs(variant)
+    workspace.materialize(variant, overlay, deleted=["old.tex"])
+
+    assert read(os.path.join(variant, "main.tex")) == b"annotated"
+    assert read(os.path.join(variant, "figures", "plot.png")) == b"replaced"
+    assert read(os.path.join(variant, "new.sty")) == b"sty"
+    assert not os.path.exists(os.path.join(variant, "old.tex"))
+    # the workspace keeps the original sources
+    assert read(os.path.join(workspace.directory, "main.tex")) == b"original"
+    assert read(os.path.join(workspace.directory, "figures", "plot.png")) == b"png"
+    assert read(os.path.join(workspace.directory, "old.tex")) == b"old"
+
+
+def test_materialize_links_assets(tmp_path):
+    store = WorkspaceStore(str(tmp_path / "workspaces"))
+    workspace = store.create(make_archive(tmp_path / "sources.tar.gz", {
+        "main.tex": b"tex",
+        "plot.png": b"png",
+        "table.dat": b"data",
+        "main.pdf": b"precompiled", # the compile writes its output here
+    }))
+    variant = str(tmp_path / "variant")
+    os.makedirs(variant)
+    workspace.materialize(variant)
+
+    asset = os.path.join(workspace.directory, "plot.png")
+    assert os.stat(os.path.join(variant, "plot.png")).st_ino == os.stat(asset).st_ino
+    tex = os.path.join(workspace.directory, "main.tex")
+    assert os.stat(os.path.join(variant, "main.tex")).st_ino != os.stat(tex).st_ino
+    data = os.path.join(workspace.directory, "table.dat") # unknown files are copied
+    assert os.stat(os.path.join(variant, "table.dat")).st_ino != os.stat(data).st_ino
+    output = os.path.join(workspace.directory, "main.pdf")
+    assert os.stat(os.path.join(variant, "main.pdf")).st_ino != os.stat(output).st_ino
+
+    store.delete(workspace.id)
+    assert store.get(workspace.id) is None
+    assert not os.path.exists(workspace.directory)
@@ -0,0 +1,162 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import Manager
+from queue import Empty
+
+import docker
+import requests
+
+from texcompile.client import ServerConnectionException, ServiceBusyException
+from utils.utils import READY_TIMEOUT, start_container
+
+REAP_WAIT = 10 # seconds for a worker killed on timeout to exit
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try: # a killed worker stays a zombie until the pool collects it
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except (OSError, IndexError):
+        return True
+
+
+class ContainerPool:
+    """
+    Fixed-size pool of warm `tex-compilation-service` containers shared by worker processes.
+
+    Workers lease a container for the duration of one paper and return it afterwards. A lease
+    checks that the service in the container still answers on /healthz and replaces it
+    otherwise; a lease that ends with a connection error also replaces the container, since it
+    is probably wedged. Containers only join the pool once they report ready on /readyz.
+    The pool is picklable, so it can be passed to pebble/multiprocessing workers as an argument.
+    `ready_timeout` is the wait for each container's warm-up compile, of which `start` runs up
+    to 16 at once.
+    """
+
+    def __init__(self, size: int, prefix: str = 'texcompile', manager=None,
+                 ready_timeout: float = READY_TIMEOUT):
+        self.size = size
+        self.prefix = prefix
+        self.ready_timeout = ready_timeout
+        self._manager = manager or Manager()
+        self._slots = self._manager.Queue()
+        self._leases = self._manager.dict() # slot index -> (pid, name, port)
+        self._client = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_manager'] = None
+        state['_client'] = None
+        return state
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = docker.from_env()
+        return self._client
+
+    def _name(self, index: int) -> str:
+        return '%s-%d-%d' % (self.prefix, index, time.time_ns())
+
+    def start(self):
+        def start_slot(index):
+            container, port = start_container(self._name(index), self.ready_timeout)
+            self._slots.put((index, container.name, port))
+        with ThreadPoolExecutor(max_workers=min(self.size, 16)) as executor:
+            list(executor.map(start_slot, range(self.size)))
+        return self
+
+    def stop(self):
+        names = [name for _, name, _ in self._leases.values()]
+        while True:
+            try:
+                _, name, _ = self._slots.get_nowait()
+            except Empty:
+                break
+            names.append(name)
+        for name in names:
+            self._stop_container(name)
+
+    def _stop_container(self, name: str):
+        try:
+            self.client.containers.get(name).stop(timeout=5)
+        except docker.errors.NotFound:
+            pass
+        except docker.errors.APIError as e:
+            print('Stop container %s failed: %s' % (name, e))
+
+    def is_healthy(self, name: str, port: int) -> bool:
+        try:
+            container = self.client.containers.get(name)
+        except docker.errors.NotFound:
+            return False
+        if container.status != 'running':
+            return False
+        try:
+            return requests.get('http://127.0.0.1:%d/healthz' % port, timeout=1).ok
+        except requests.exceptions.RequestException:
+            return False
+
+    def replace(self, index: int, name: str):
+        self._stop_container(name)
+        container, port = start_container(self._name(index), self.ready_timeout)
+        return container.name, port
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """
+        Yield the port of a healthy container. Blocks until one is free.
+        """
+        index, name, port = self._slots.get(timeout=timeout)
+        self._leases[index] = (os.getpid(), name, port)
+        wedged = False
+        try:
+            if not self.is_healthy(name, port):
+                name, port = self.replace(index, name)
+                self._leases[index] = (os.getpid(), name, port)
+            yield port
+        except ServiceBusyException:
+            raise # the container answered, it is not wedged
+        except ServerConnectionException:
+            # error responses and read timeouts of long compiles come from a working container
+            wedged = not self.is_healthy(name, port)
+            raise
+        finally:
+            try:
+                if wedged:
+                    name, port = self.replace(index, name)
+            finally:
+                # if the replacement failed, the dead slot goes back and the next lease
+                # replaces it, so that the pool never shrinks
+                del self._leases[index]
+                self._slots.put((index, name, port))
+
+    def reap(self, wait: float = 0) -> int:
+        """
+        Return slots leased by worker processes that died (e.g. killed on timeout) to the pool.
+        Their containers are replaced, as the interrupted compile may still be running.
+        A worker may still be exiting when its timeout is reported, so with `wait` the leases
+        are polled for up to that many seconds until one is reaped. Returns the number reaped.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            reaped = 0
+            for index, (pid, name, port) in list(self._leases.items()):
+                if not _pid_alive(pid):
+                    del self._leases[index]
+                    reaped += 1
+                    try:
+                        name, port = self.replace(index, name)
+                    finally:
+                        self._slots.put((index, name, port))
+            if reaped or time.monotonic() >= deadline:
+                return reaped
+            time.sleep(0.1)
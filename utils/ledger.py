@@ -0,0 +1,234 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Set
+
+from texcompile.client import CompilationException, ServerConnectionException
+
+# Failures worth another attempt on the next run. Everything else (LaTeX errors, parser
+# errors on the sources) fails the same way again.
+TRANSIENT_ERRORS = (ServerConnectionException, TimeoutError, ConnectionError, MemoryError)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    paper TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    transient INTEGER,
+    error_class TEXT,
+    error TEXT,
+    started REAL,
+    finished REAL,
+    duration REAL,
+    output_hash TEXT,
+    detail TEXT,
+    PRIMARY KEY (paper, stage)
+);
+CREATE INDEX IF NOT EXISTS stages_state ON stages (stage, state);
+"""
+
+
+def is_transient(e: BaseException) -> bool:
+    if not isinstance(e, Exception): # interrupted, e.g. KeyboardInterrupt
+        return True
+    if isinstance(e, CompilationException):
+        return False
+    return isinstance(e, TRANSIENT_ERRORS)
+
+
+class StageRecord:
+    """
+    Handle yielded by `JobLedger.stage`, used to attach the stage's output to its ledger entry.
+    """
+
+    def __init__(self):
+        self.output_hash = None
+        self.detail = None
+
+    def output(self, data) -> None:
+        if hasattr(data, 'getbuffer'):
+            data = data.getbuffer()
+        elif not isinstance(data, (bytes, bytearray, memoryview)):
+            with open(data, 'rb') as f:
+                data = f.read()
+        self.output_hash = hashlib.sha256(data).hexdigest()
+
+
+class JobLedger:
+    """
+    SQLite-backed record of the state of every (paper, stage) pair of a batch run.
+
+    A stage is 'running', 'done' or 'failed'. Failed stages keep the error class, whether the
+    error is transient, and the number of attempts, so a restarted run can skip completed and
+    permanently failed papers with a single query instead of checking output files. The ledger
+    is picklable and opens one connection per process and thread; WAL mode lets the worker
+    processes of a run write to it concurrently.
+    """
+
+    def __init__(self, path, max_attempts: int = 3):
+        self.path = str(path)
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._execute(SCHEMA, script=True)
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_attempts': self.max_attempts}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql: str, args=(), script=False):
+        if script:
+            return self.connection.executescript(sql)
+        return self.connection.execute(sql, args)
+
+    def start(self, paper: str, stage: str) -> None:
+        self._execute(
+            """INSERT INTO stages (paper, stage, state, attempts, started)
+            VALUES (?, ?, 'running', 1, ?)
+            ON CONFLICT (paper, stage) DO UPDATE SET
+                state = 'running', attempts = attempts + 1, started = excluded.started,
+                finished = NULL, duration = NULL, error_class = NULL, error = NULL, transient = NULL""",
+            (paper, stage, time.time()),
+        )
+
+    def finish(self, paper: str, stage: str, output_hash: Optional[str] = None, detail: Optional[str] = None) -> None:
+        now = time.time()
+        self._execute(
+            """UPDATE stages SET state = 'done', finished = ?, duration = ? - started,
+                output_hash = ?, detail = ?
+            WHERE paper = ? AND stage = ?""",
+            (now, now, output_hash, detail, paper, stage),
+        )
+
+    def fail(self, paper: str, stage: str, error: BaseException) -> None:
+        now = time.time()
+        message = ''.join(traceback.format_exception_only(type(error), error)).strip()
+        self._execute(
+            """UPDATE stages SET state = 'failed', finished = ?, duration = ? - started,
+                error_class = ?, error = ?, transient = ?
+            WHERE paper = ? AND stage = ?""",
+            (now, now, type(error).__name__, message[:2000], int(is_transient(error)), paper, stage),
+        )
+
+    def abort(self, paper: str, error_class: str, transient: bool = True) -> None:
+        """
+        Fail all running stages of a paper whose worker was killed, e.g. on timeout.
+        """
+        now = time.time()
+        self._execute(
+            """UPDATE stages SET state = 'failed', finished = ?, duration = ? - started,
+                error_class = ?, transient = ?
+            WHERE paper = ? AND state = 'running'""",
+            (now, now, error_class, int(transient), paper),
+        )
+
+    @contextmanager
+    def stage(self, paper: str, stage: str):
+        self.start(paper, stage)
+        record = StageRecord()
+        try:
+            yield record
+        except BaseException as e:
+            self.fail(paper, stage, e)
+            raise
+        self.finish(paper, stage, record.output_hash, record.detail)
+
+    def get(self, paper: str, stage: str) -> Optional[Dict]:
+        cursor = self._execute('SELECT * FROM stages WHERE paper = ? AND stage = ?', (paper, stage))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cursor.description], row))
+
+    def done_stages(self, paper: str) -> Set[str]:
+        cursor = self._execute("SELECT stage FROM stages WHERE paper = ? AND state = 'done'", (paper,))
+        return {stage for stage, in cursor}
+
+    def completed(self, stages: Iterable[str]) -> Set[str]:
+        """
+        Papers for which all of `stages` are done.
+        """
+        stages = list(stages)
+        cursor = self._execute(
+            """SELECT paper FROM stages WHERE state = 'done' AND stage IN (%s)
+            GROUP BY paper HAVING COUNT(*) = ?""" % ','.join('?' * len(stages)),
+            stages + [len(stages)],
+        )
+        return {paper for paper, in cursor}
+
+    def given_up(self) -> Set[str]:
+        """
+        Papers with a stage that failed permanently or ran out of attempts. Stages left
+        'running' by a crashed run count as transient failures.
+        """
+        cursor = self._execute(
+            """SELECT DISTINCT paper FROM stages
+            WHERE (state = 'failed' AND transient = 0) OR (state != 'done' AND attempts >= ?)""",
+            (self.max_attempts,),
+        )
+        return {paper for paper, in cursor}
+
+    def to_skip(self, stages: Iterable[str]) -> Set[str]:
+        return self.completed(stages) | self.given_up()
+
+    def throughput(self, since: float = 0) -> List[Dict]:
+        cursor = self._execute(
+            """SELECT stage, COUNT(*), AVG(duration), MIN(started), MAX(finished)
+            FROM stages WHERE state = 'done' AND finished >= ? GROUP BY stage ORDER BY stage""",
+            (since,),
+        )
+        rows = []
+        for stage, count, avg, first, last in cursor:
+            elapsed = (last - first) if last and first else 0
+            rows.append({
+                'stage': stage,
+                'done': count,
+                'avg_seconds': avg,
+                'per_hour': count / elapsed * 3600 if elapsed > 0 else None,
+            })
+        return rows
+
+    def failures(self) -> List[Dict]:
+        cursor = self._execute(
+            """SELECT stage, error_class, transient, COUNT(*) FROM stages WHERE state = 'failed'
+            GROUP BY stage, error_class, transient ORDER BY COUNT(*) DESC"""
+        )
+        return [
+            {'stage': stage, 'error_class': error_class, 'transient': bool(transient), 'count': count}
+            for stage, error_class, transient, count in cursor
+        ]
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Summarize a batch run's job ledger.")
+    parser.add_argument("ledger", help="Path to the SQLite ledger file.")
+    args = parser.parse_args()
+
+    ledger = JobLedger(args.ledger)
+    print('Throughput:')
+    for row in ledger.throughput():
+        per_hour = '-' if row['per_hour'] is None else '%.1f/h' % row['per_hour']
+        print('  %-20s %8d done  avg %7.1fs  %s' % (row['stage'], row['done'], row['avg_seconds'] or 0, per_hour))
+    print('Failures:')
+    for row in ledger.failures():
+        kind = 'transient' if row['transient'] else 'permanent'
+        print('  %-20s %-30s %-9s %d' % (row['stage'], row['error_class'], kind, row['count']))
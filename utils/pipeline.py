@@ -0,0 +1,89 @@
+import logging
+import threading
+from dataclasses import dataclass
+from queue import Queue
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[[Any], Any]
+    " Called with the job, returns the job for the next stage. "
+    workers: int = 1
+    queue_size: Optional[int] = None
+    " Bound of the stage's input queue, defaults to twice the number of workers. "
+
+
+class Pipeline:
+    """
+    Run jobs through a sequence of stages, each with its own bounded input queue and its own
+    pool of worker threads. Different jobs occupy different stages at the same time, e.g. one
+    paper is being compiled while the PDF of another one is being extracted. A full queue
+    blocks the previous stage, so the number of jobs in flight stays bounded.
+
+    Stage functions run in threads. CPU-bound stages should hand their work to a process pool
+    themselves; the stage's worker count then bounds how many of those tasks are in flight.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        on_done: Callable[[Any], None] = lambda job: None,
+        on_error: Callable[[Any, str, Exception], None] = lambda job, stage, e: None,
+    ):
+        self.stages = stages
+        self.on_done = on_done
+        self.on_error = on_error
+        self.queues = [Queue(maxsize=s.queue_size or 2 * s.workers) for s in stages]
+        self._alive = [s.workers for s in stages]
+        self._lock = threading.Lock()
+
+    def _worker(self, i: int):
+        stage = self.stages[i]
+        try:
+            while True:
+                job = self.queues[i].get()
+                if job is _STOP:
+                    break
+                try:
+                    self._process(i, stage, job)
+                except Exception:
+                    # a failing callback must not kill the worker, or run() never returns
+                    logger.exception('Handling a job in stage %s failed.', stage.name)
+        finally:
+            with self._lock:
+                self._alive[i] -= 1
+                last = self._alive[i] == 0
+            if last and i + 1 < len(self.stages): # propagate shutdown once the stage is drained
+                for _ in range(self.stages[i + 1].workers):
+                    self.queues[i + 1].put(_STOP)
+
+    def _process(self, i: int, stage: Stage, job: Any):
+        try:
+            job = stage.fn(job)
+        except Exception as e:
+            self.on_error(job, stage.name, e)
+            return
+        if i + 1 < len(self.stages):
+            self.queues[i + 1].put(job)
+        else:
+            self.on_done(job)
+
+    def run(self, jobs: Iterable[Any]):
+        threads = []
+        for i, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(i,), name='%s-%d' % (stage.name, n), daemon=True)
+                t.start()
+                threads.append(t)
+        for job in jobs:
+            self.queues[0].put(job)
+        for _ in range(self.stages[0].workers):
+            self.queues[0].put(_STOP)
+        for t in threads:
+            t.join()
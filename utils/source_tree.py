@@ -0,0 +1,172 @@
+import gzip
+import os
+import posixpath
+import tarfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from texcompile.service.lib.links import linked_paths
+
+
+def _safe_member_path(name: str) -> Optional[str]:
+    """
+    Normalize a tar member name to a relative POSIX path, or return None if it would be
+    written outside of the extraction directory (absolute paths or '..' components).
+    """
+    path = posixpath.normpath(name.replace('\\', '/'))
+    if path.startswith('/') or path == '..' or path.startswith('../') or path == '.':
+        return None
+    return path
+
+
+class SourceTree:
+    """
+    In-memory LaTeX source package, mapping relative POSIX paths to file contents.
+
+    The archive is decompressed once per paper. Each compilation pass then materializes the
+    tree on disk with `write_to`, and `restore` brings a directory that a previous pass has
+    modified back to the original sources by rewriting only the files that changed. `diff`
+    lists those changes, e.g. to upload only them to a compile workspace.
+    """
+
+    def __init__(self, files: Optional[Mapping[str, bytes]] = None) -> None:
+        self.files: Dict[str, bytes] = dict(files or {})
+        self._written: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+
+    @classmethod
+    def from_archive(cls, filename) -> 'SourceTree':
+        """
+        Load a gzipped tar as downloaded from arXiv. Single-file submissions are gzipped TeX
+        without a tar wrapper; those become a tree with one 'main.tex'.
+        """
+        files = {}
+        try:
+            with tarfile.open(filename, 'r:gz') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue # links and devices are never extracted
+                    path = _safe_member_path(member.name)
+                    if path is None:
+                        continue
+                    f = tar.extractfile(member)
+                    if f is not None:
+                        files[path] = f.read()
+        except tarfile.ReadError:
+            with gzip.open(filename, 'rb') as gz:
+                files = {'main.tex': gz.read()}
+        return cls(files)
+
+    @classmethod
+    def from_dir(cls, path) -> 'SourceTree':
+        files = {}
+        root = Path(path)
+        for p in root.rglob('*'):
+            if p.is_file() and not p.is_symlink():
+                files[p.relative_to(root).as_posix()] = p.read_bytes()
+        return cls(files)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.files
+
+    def __getitem__(self, path: str) -> bytes:
+        return self.files[path]
+
+    @property
+    def size(self) -> int:
+        return sum(len(b) for b in self.files.values())
+
+    def copy(self) -> 'SourceTree':
+        # bytes are immutable, so the copy shares file contents with the original
+        return SourceTree(self.files)
+
+    def overlay(self, changes: Mapping[str, bytes], deleted: Iterable[str] = ()) -> 'SourceTree':
+        files = dict(self.files)
+        for path in deleted:
+            files.pop(path, None)
+        files.update(changes)
+        return SourceTree(files)
+
+    def write_to(self, dest, link_from=None) -> None:
+        """
+        Write every file of the tree below `dest`. If `link_from` is a directory into which
+        this tree was already written, figures and fonts (see `linked_paths`) are hard-linked
+        from there instead of written again.
+        """
+        dest = str(dest)
+        stats = {}
+        linked = set(linked_paths(self.files)) if link_from is not None else set()
+        for path, contents in self.files.items():
+            full = os.path.join(dest, path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            if os.path.lexists(full):
+                os.remove(full)
+            if path in linked:
+                try:
+                    os.link(os.path.join(str(link_from), path), full)
+                    stats[path] = self._stat(full)
+                    continue
+                except OSError:
+                    pass
+            with open(full, 'wb') as f:
+                f.write(contents)
+            stats[path] = self._stat(full)
+        self._written[os.path.realpath(dest)] = stats
+
+    def restore(self, dest) -> None:
+        """
+        Make `dest`, previously populated by `write_to`, match the tree again: rewrite files
+        that were modified or replaced since, and remove files that were added.
+        """
+        dest = str(dest)
+        stats = self._written.get(os.path.realpath(dest))
+        if stats is None:
+            self.write_to(dest)
+            return
+        for dirpath, _, filenames in os.walk(dest):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                path = Path(full).relative_to(dest).as_posix()
+                if path not in self.files:
+                    os.remove(full)
+        for path, contents in self.files.items():
+            full = os.path.join(dest, path)
+            if os.path.exists(full) and self._stat(full) == stats.get(path):
+                continue
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            if os.path.lexists(full):
+                os.remove(full) # never write through a hard link shared with another copy
+            with open(full, 'wb') as f:
+                f.write(contents)
+            stats[path] = self._stat(full)
+
+    def diff(self, dest) -> Tuple[Dict[str, bytes], List[str]]:
+        """
+        Compare `dest` with the tree: return the files of `dest` that were added or differ
+        from the tree, and the paths of the tree that are missing from `dest`. Files whose
+        stats still match what `write_to` recorded are not read.
+        """
+        dest = str(dest)
+        stats = self._written.get(os.path.realpath(dest), {})
+        changes = {}
+        present = set()
+        for dirpath, _, filenames in os.walk(dest):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                path = Path(full).relative_to(dest).as_posix()
+                present.add(path)
+                if path in self.files and self._stat(full) == stats.get(path):
+                    continue
+                with open(full, 'rb') as f:
+                    contents = f.read()
+                if self.files.get(path) != contents:
+                    changes[path] = contents
+        deleted = [path for path in self.files if path not in present]
+        return changes, deleted
+
+    @staticmethod
+    def _stat(full: str) -> Tuple[int, int, int]:
+        st = os.stat(full)
+        return st.st_ino, st.st_size, st.st_mtime_ns
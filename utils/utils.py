@@ -6,6 +6,7 @@ from pathlib import Path
 import chardet
 import time
 import docker
+import requests
 
 
 def find_free_port() -> int:  
@@ -16,21 +17,53 @@ def find_free_port() -> int:
         return s.getsockname()[1]
     
 
-def check_container_ready(container):
-    for _ in range(120): # timeout
-        container.reload()
-        if container.status == 'running':
-            return
-        time.sleep(1)
+# Seconds to wait for a container's warm-up compile. Containers started together share the
+# CPU for it, so a pool starting many at once needs more than a single container.
+READY_TIMEOUT = float(os.environ.get('TEXCOMPILE_READY_TIMEOUT', 300))
+READY_POLL_INTERVAL = 0.2
+
+
+class WarmUpFailed(RuntimeError):
+    """
+    The warm-up compile of a container failed, so the image itself is broken (e.g. TeX Live
+    is missing). Starting another container would fail the same way.
+    """
+
+
+def check_container_ready(container, port: int, timeout: float = READY_TIMEOUT):
+    """
+    Wait until the service in the container reports ready on /readyz, i.e. its warm-up compile
+    succeeded. Raises if the container exits, the warm-up fails or `timeout` seconds pass.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = requests.get('http://127.0.0.1:%d/readyz' % port, timeout=1)
+            if response.ok:
+                return
+            if response.json().get('status') == 'failed':
+                raise WarmUpFailed('Container not ready: ' + response.json().get('detail', ''))
+        except (requests.exceptions.RequestException, ValueError):
+            container.reload() # not answering yet, make sure it is still starting
+            if container.status not in ('created', 'running'):
+                raise RuntimeError('Container exited with status %s.' % container.status)
+        time.sleep(READY_POLL_INTERVAL)
     raise TimeoutError('Container init error.')
     
 
-def start_container(name: str):
+def _remove_container(client, name: str):
+    try:
+        client.containers.get(name).remove(force=True)
+    except docker.errors.APIError: # gone already, or being removed after it stopped
+        pass
+
+
+def start_container(name: str, ready_timeout: float = READY_TIMEOUT):
     client = docker.from_env()
     try: # reuse existing contianer
         container = client.containers.get(name)
         port = int(container.ports['80/tcp'][0]['HostPort'])
-        check_container_ready(container)
+        check_container_ready(container, port, ready_timeout)
         return container, port
     except docker.errors.NotFound:
         for _ in range(10):
@@ -44,10 +77,14 @@ def start_container(name: str):
                     remove=True,
                     name=name
                 )
-                time.sleep(3)
-                check_container_ready(container)
+                check_container_ready(container, port, ready_timeout)
                 return container, port
-            except:
+            except WarmUpFailed:
+                _remove_container(client, name)
+                raise
+            except Exception as e:
+                print('Start container %s failed, retrying: %s' % (name, e))
+                _remove_container(client, name) # frees the name for the next attempt
                 time.sleep(1)
         raise TimeoutError('Create container failed.')
     except docker.errors.APIError as e: